@@ -0,0 +1,39 @@
+from tame.api import Array, NaturalNumber
+from tame.model import Type
+import time
+
+# --
+# ## Generic instantiation
+#
+# Measures the number of instantiations per second of nested generics like
+# `Array(Array(Array(NaturalNumber)))`, once the instances exist, and the
+# creation of fresh instances.
+
+COUNT = 100_000
+Map = Type("Map", K=None, V=None)
+
+
+def nest(depth: int, base: Type = NaturalNumber) -> Type:
+    res = base
+    for _ in range(depth):
+        res = Array(res)
+    return res
+
+
+def measure(name: str, create, count: int = COUNT, per: int = 1):
+    started = time.perf_counter()
+    for i in range(count):
+        create(i)
+    elapsed = time.perf_counter() - started
+    print(f"{name:24s} {count * per / elapsed:12,.0f} instantiations/s")
+
+
+for depth in (1, 4, 16):
+    nest(depth)
+    measure(f"Array^{depth}", lambda i: nest(depth), count=COUNT // depth, per=depth)
+inner = nest(8)
+measure("Map[Array^8,Array^8]", lambda i: Map(inner, inner))
+leaves = [Type(f"Leaf{i}") for i in range(COUNT // 10)]
+measure("Array^4 (fresh)", lambda i: nest(4, leaves[i]), count=COUNT // 10, per=4)
+
+# EOF
@@ -0,0 +1,86 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# --
+# ## Import time
+#
+# Measures the import time of tame modules with `python -X importtime`, and
+# fails (exits with 1) on regressions: when an import exceeds its budget,
+# pulls in one of the `Deferred` modules, or materializes standard types.
+
+# Modules that must only be imported when used
+Deferred: tuple[str, ...] = (
+    "dataclasses",
+    "hashlib",
+    "pathlib",
+    "numpy",
+    "tame.backends.cache",
+    "tame.backends.numpy",
+    "tame.backends.jit",
+)
+
+# Budgets (in milliseconds) of the cumulative import time of each module
+Budgets: dict[str, float] = {
+    "tame.model": 30.0,
+    "tame.api": 30.0,
+    "tame.backends": 40.0,
+    "tame.backends.c": 40.0,
+}
+
+CHECK = (
+    "import sys;from tame.model import Type;"
+    "print(len(Type.Registry.nodes));"
+    "print(' '.join(_ for _ in sys.modules))"
+)
+
+
+def measure(module: str) -> tuple[float, int, set[str]]:
+    """Returns the cumulative import time of the module in ms, the number of
+    types that exist after the import, and the imported modules."""
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module};{CHECK}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=os.environ,
+    )
+    elapsed = 0.0
+    for line in res.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if name.strip() == module:
+                elapsed = int(cumulative) / 1000.0
+    types, modules = res.stdout.splitlines()
+    return elapsed, int(types), set(modules.split())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks the import time of tame modules"
+    )
+    parser.add_argument("modules", nargs="*", default=list(Budgets))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="Budget factor")
+    args = parser.parse_args()
+    failed = False
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.runs)]
+        elapsed = min(_[0] for _ in runs)
+        _, types, modules = runs[0]
+        budget = Budgets.get(module, float("inf")) * args.scale
+        deferred = sorted(_ for _ in Deferred if _ in modules and _ != module)
+        errors = (
+            ([f"over budget ({budget:.0f}ms)"] if elapsed > budget else [])
+            + ([f"imports {', '.join(deferred)}"] if deferred else [])
+            + ([f"creates {types} types"] if types else [])
+        )
+        failed = failed or bool(errors)
+        print(
+            f"{module:24s} {elapsed:8.1f}ms {'FAIL ' + '; '.join(errors) if errors else 'OK'}"
+        )
+    sys.exit(1 if failed else 0)
+
+# EOF
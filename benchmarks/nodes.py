@@ -0,0 +1,39 @@
+from tame.api import NaturalNumber, B32
+from tame.model import Literal, Application, Operator, Type
+import time
+import tracemalloc
+
+# --
+# ## Model node footprint
+#
+# Measures the bytes allocated per model node and the number of nodes
+# constructed per second, for literals, applications and types.
+
+COUNT = 100_000
+
+
+def measure(name: str, create, count: int = COUNT):
+    # We first measure the memory, keeping the nodes alive
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = [create(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del nodes
+    # And then the throughput, without tracing
+    started = time.perf_counter()
+    nodes = [create(i) for i in range(count)]
+    elapsed = time.perf_counter() - started
+    del nodes
+    print(
+        f"{name:12s} {(after - before) / count:8.1f} bytes/node {count / elapsed:12,.0f} nodes/s"
+    )
+
+
+one = Literal(NaturalNumber, B32, 1)
+measure("Literal", lambda i: Literal(NaturalNumber, B32, i))
+measure("Application", lambda i: Application(Operator.Add, one, one))
+measure("Value.__add__", lambda i: one + one)
+measure("Type", lambda i: Type(f"T{i}"), count=COUNT // 10)
+
+# EOF
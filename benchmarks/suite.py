@@ -0,0 +1,333 @@
+from tame.api import Any, Number, NaturalNumber, Array, B32, T
+from tame.model import Type, Value, Expression
+from tame.universe import Universe
+from tame.utils.dag import DAG, toASCII, toDOTLines
+from tame.backends.c import CBackend
+from typing import Callable, NamedTuple, Optional
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+# --
+# ## Benchmark suite
+#
+# Runs the benchmarks of the paths the generator runs the most (type
+# creation, instantiation and queries, DAG traversals, tree construction
+# and emission) on synthetic inputs of increasing sizes. Results can be
+# written as JSON and compared to a baseline, in which case the runner
+# exits with 1 when a benchmark is slower than the baseline by more than
+# the tolerance. Larger sizes of a benchmark are skipped when their
+# run time, extrapolated linearly, would exceed the budget.
+#
+# ```
+# PYTHONPATH=src/py python benchmarks/suite.py --json baseline.json
+# PYTHONPATH=src/py python benchmarks/suite.py --baseline baseline.json
+# ```
+
+SEED = 0
+SIZES = (1_000, 10_000, 100_000)
+
+
+class Case(NamedTuple):
+    """A benchmark case: `run` processes `count` units each time it is
+    called, and `teardown` is called after each run."""
+
+    run: Callable[[], object]
+    count: int
+    unit: str = "op"
+    teardown: Optional[Callable[[], object]] = None
+
+
+Benchmarks: dict[str, Callable[[int], Case]] = {}
+
+
+def benchmark(name: str):
+    def decorator(setup: Callable[[int], Case]):
+        Benchmarks[name] = setup
+        return setup
+
+    return decorator
+
+
+def hierarchy(size: int) -> list[Type]:
+    """Creates a hierarchy of types, each deriving from one or two
+    random previous types."""
+    rng = random.Random(SEED)
+    types = [Any, Number]
+    for i in range(size):
+        t = Type(f"T{i}") << types[rng.randrange(len(types))]
+        if rng.random() < 0.2:
+            t << types[rng.randrange(len(types))]
+        types.append(t)
+    return types
+
+
+def synthetic(size: int, fanin: int = 3) -> DAG[str, int]:
+    """Creates a DAG of nodes with up to `fanin` inputs among the
+    previous nodes, mostly close ones."""
+    rng = random.Random(SEED)
+    dag: DAG[str, int] = DAG()
+    for i in range(size):
+        node = f"n{i}"
+        dag.setNode(node, i)
+        for _ in range(rng.randrange(fanin + 1) if i else 0):
+            dag.addInput(node, f"n{max(0, i - 1 - int(rng.expovariate(0.1)))}")
+    return dag
+
+
+def forest(size: int) -> DAG[int, int]:
+    """Creates a DAG shaped like a type registry: each node derives from
+    one random previous node, and sometimes a second one."""
+    rng = random.Random(SEED)
+    dag: DAG[int, int] = DAG()
+    for i in range(size):
+        dag.setNode(i, i)
+        if i:
+            dag.addInput(i, rng.randrange(i))
+            if rng.random() < 0.2:
+                dag.addInput(i, rng.randrange(i))
+    return dag
+
+
+def tree(size: int) -> Expression:
+    """Returns a tree of `size` applications."""
+    x = Value(NaturalNumber, B32, "x")
+    res: Expression = x
+    for i in range(size):
+        res = res * x + T.int(i) if i % 2 else res - T.int(i)
+    return res
+
+
+@benchmark("type.create")
+def typeCreate(size: int) -> Case:
+    # NOTE: Each run creates its types in a fresh copy of the default
+    # universe, so that all the runs start from the same registry.
+    universes = [Universe(Universe.Default)]
+
+    def run():
+        with universes[-1]:
+            for i in range(size):
+                Type(f"T{i}") << Number
+
+    def teardown():
+        universes.append(Universe(Universe.Default))
+
+    return Case(run, size, "type", teardown)
+
+
+@benchmark("type.instantiate")
+def typeInstantiate(size: int) -> Case:
+    universe = Universe(Universe.Default)
+    with universe:
+        types = [Type(f"T{i}") for i in range(size)]
+        for _ in types:
+            Array(Array(_))
+
+    def run():
+        with universe:
+            for _ in types:
+                Array(Array(_))
+
+    return Case(run, 2 * size, "instance")
+
+
+@benchmark("type.isa")
+def typeIsa(size: int) -> Case:
+    universe = Universe(Universe.Default)
+    with universe:
+        types = hierarchy(size)
+    rng = random.Random(SEED)
+    pairs = [(rng.choice(types), rng.choice(types)) for _ in range(size)]
+
+    def run():
+        with universe:
+            for a, b in pairs:
+                a.isa(b)
+
+    return Case(run, size, "query")
+
+
+@benchmark("type.intersect")
+def typeIntersect(size: int) -> Case:
+    universe = Universe(Universe.Default)
+    with universe:
+        types = hierarchy(size)
+    rng = random.Random(SEED)
+    pairs = [(rng.choice(types), rng.choice(types)) for _ in range(size)]
+
+    def run():
+        with universe:
+            for a, b in pairs:
+                a.intersect(b)
+
+    return Case(run, size, "query")
+
+
+@benchmark("dag.ranks")
+def dagRanks(size: int) -> Case:
+    dag = synthetic(size)
+    return Case(dag.ranks, size, "node")
+
+
+@benchmark("dag.successors")
+def dagSuccessors(size: int) -> Case:
+    dag = synthetic(size)
+
+    def run():
+        for _ in dag.successors().values():
+            pass
+
+    return Case(run, size, "node")
+
+
+@benchmark("dag.reaches")
+def dagReaches(size: int) -> Case:
+    dag = forest(size)
+    dag.reachability()
+    rng = random.Random(SEED)
+    pairs = [(rng.randrange(size), rng.randrange(size)) for _ in range(size)]
+
+    def run():
+        for a, b in pairs:
+            dag.reaches(a, b)
+
+    return Case(run, size, "query")
+
+
+@benchmark("dag.transitiveReduction")
+def dagTransitiveReduction(size: int) -> Case:
+    dags: list[DAG] = []
+
+    def run():
+        dags[-1].transitiveReduction()
+
+    def teardown():
+        dags.append(forest(size))
+
+    teardown()
+    return Case(run, size, "node", teardown)
+
+
+@benchmark("dag.addEdges")
+def dagAddEdges(size: int) -> Case:
+    dag = forest(size)
+    edges = [(node, _) for node in dag.nodes for _ in dag.inputs[node]]
+    return Case(lambda: DAG(indexed=True).addEdges(edges), len(edges), "edge")
+
+
+@benchmark("dag.toASCII")
+def dagToASCII(size: int) -> Case:
+    dag = synthetic(size)
+    return Case(lambda: toASCII(dag), size, "node")
+
+
+@benchmark("dag.toDOT")
+def dagToDOT(size: int) -> Case:
+    dag = synthetic(size)
+
+    def run():
+        for _ in toDOTLines(dag):
+            pass
+
+    return Case(run, size, "node")
+
+
+@benchmark("application.build")
+def applicationBuild(size: int) -> Case:
+    return Case(lambda: tree(size), 2 * size, "node")
+
+
+@benchmark("emit.c")
+def emitC(size: int) -> Case:
+    backend = CBackend()
+    value = tree(size)
+    length = len(str(backend(value)))
+    return Case(lambda: str(backend(value)), length, "byte")
+
+
+def measure(setup: Callable[[int], Case], size: int, repeat: int) -> dict:
+    """Returns the best of `repeat` runs of the case."""
+    case = setup(size)
+    times: list[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - started)
+        if case.teardown:
+            case.teardown()
+    best = min(times)
+    return {
+        "size": size,
+        "unit": case.unit,
+        "count": case.count,
+        "seconds": best,
+        "throughput": case.count / best,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns the benchmarks whose throughput is lower than the baseline's
+    by more than the tolerance (as a fraction)."""
+    regressions: list[str] = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference:
+            ratio = result["throughput"] / reference["throughput"]
+            if ratio < 1.0 - tolerance:
+                regressions.append(f"{key}: {ratio:.2f}x of baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the tame benchmark suite")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmark name prefixes")
+    parser.add_argument(
+        "--sizes", default=",".join(str(_) for _ in SIZES), help="Input sizes"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Writes the results to the given path")
+    parser.add_argument("--baseline", help="Compares to the results at the path")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--budget", type=float, default=5.0, help="Seconds per run before skipping"
+    )
+    args = parser.parse_args()
+    sizes = [int(_) for _ in args.sizes.split(",")]
+    results: dict[str, dict] = {}
+    for name, setup in Benchmarks.items():
+        if args.benchmarks and not any(name.startswith(_) for _ in args.benchmarks):
+            continue
+        for i, size in enumerate(sizes):
+            key = f"{name}[{size}]"
+            result = results[key] = measure(setup, size, args.repeat)
+            print(
+                f"{key:28s} {result['seconds'] * 1000:10.2f}ms {result['throughput']:14,.0f} {result['unit']}/s"
+            )
+            if (
+                i + 1 < len(sizes)
+                and result["seconds"] * sizes[i + 1] / size > args.budget
+            ):
+                print(f"{name:28s} skipping larger sizes (over {args.budget}s)")
+                break
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for _ in regressions:
+            print(f"REGRESSION {_}")
+        sys.exit(1 if regressions else 0)
+
+# EOF
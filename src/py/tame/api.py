@@ -1,25 +1,107 @@
-from dataclasses import dataclass
-from typing import TypeVar
-from .model import Type, Structure, Value, Literal, Sequence, Operation, Operator
+from typing import Callable, Optional, TypeVar
+from .model import (
+    Type,
+    Structure,
+    Value,
+    Literal,
+    Sequence,
+    Operation,
+    Operator,
+    Interned,
+)
+from .universe import Universe
+from threading import RLock
 
 A = TypeVar("A")
 
-B8 = Structure(8)
-B16 = Structure(16)
-B32 = Structure(32)
-B64 = Structure(64)
-B128 = Structure(128)
+# --
+# ## Standard types
+#
+# The standard structures and types are materialized on first access
+# (through the module's `__getattr__`), so that importing `tame` doesn't
+# build them. They are always created in the default universe, and all of
+# them are materialized before a universe is derived from it.
 
+Standard: dict[str, Callable[[], object]] = {
+    "B8": lambda: Structure(8),
+    "B16": lambda: Structure(16),
+    "B32": lambda: Structure(32),
+    "B64": lambda: Structure(64),
+    "B128": lambda: Structure(128),
+    "Any": lambda: Type("Any"),
+    "Number": lambda: Type("Number") << standard("Any"),
+    "NaturalNumber": lambda: Type("NaturalNumber") << standard("Number"),
+    "DecimalNumber": lambda: Type("DecimalNumber") << standard("Number"),
+    "Array": lambda: Type("Array", T=standard("Any")),
+}
 
-Any = Type("Any")
-Number = Type("Number") << Any
-NaturalNumber = Type("NaturalNumber") << Number
-DecimalNumber = Type("DecimalNumber") << Number
-Array = Type("Array", T=Any)
+
+# NOTE: Reentrant, as standard types are built from other standard types
+Materializing = RLock()
+
+
+def standard(name: str):
+    """Returns the standard structure or type with the given name,
+    creating it on first access."""
+    res = globals().get(name)
+    if res is None:
+        if name not in Standard:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        with Materializing, Universe.Default:
+            res = globals().get(name)
+            if res is None:
+                res = globals()[name] = Standard[name]()
+    return res
+
+
+def adopt(name: str, value: object):
+    """Uses the given value as the standard structure or type of the given
+    name, as when restoring the types of another process, where standard
+    types may already be registered under other ids (see
+    `parallel.Snapshot`)."""
+    assert name in Standard, f"Not a standard structure or type: {name}"
+    with Materializing:
+        globals()[name] = value
+    return value
+
+
+def materialize():
+    """Creates all the standard structures and types that don't exist yet."""
+    for name in Standard:
+        standard(name)
+
+
+__all__ = [
+    "Type",
+    "Structure",
+    "Value",
+    "Literal",
+    "Sequence",
+    "Operation",
+    "Operator",
+    "Interned",
+    "Universe",
+    "standard",
+    "adopt",
+    "materialize",
+    "int32",
+    "T",
+    *Standard,
+]
+
+
+def __getattr__(name: str):
+    return standard(name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(Standard))
 
 
 def int32(value: int) -> Literal[int]:
-    return Literal[int](NaturalNumber, structure=B32, value=value)
+    return Literal[int](
+        standard("NaturalNumber"), structure=standard("B32"), value=value
+    )
 
 
 class T:
@@ -28,8 +110,12 @@ class T:
         return int32(value)
 
     @staticmethod
-    def array(value: Literal[A], count: int) -> Value:
-        return Value(type=Array(value.type), structure=Sequence(value.size, count))
+    def array(value: Literal[A], count: int, name: Optional[str] = None) -> Value:
+        return Value(
+            type=standard("Array")(value.type),
+            structure=Sequence(value.size, count),
+            name=name,
+        )
 
 
 # EOF
@@ -1,7 +1,14 @@
-from ..model import Value, Application, Operator
-from typing import Iterable, Union
-from io import StringIO
+from ..model import Expression, Value, Application, Operator, Operation, Type
+from .walk import expand
+from .passes import Fold
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, Union, TextIO
 from enum import Enum
+from importlib import import_module
+import os
+
+# NOTE: The cache (and its dependencies) is only imported when used
+if TYPE_CHECKING:
+    from .cache import Cache
 
 
 class Control(Enum):
@@ -13,36 +20,244 @@ class Control(Enum):
 START = Control.START
 END = Control.END
 EOL = Control.EOL
-TOutput = Iterable[Union[str, Control]]
+# Backend handlers may yield values and applications, which are expanded
+# to their own output.
+TOutput = Iterable[Union[str, Control, Expression]]
 
 
 class Output:
-    def __init__(self, stream: TOutput):
+    """Wraps a stream of output atoms, which is consumed lazily. `START` and
+    `END` increase and decrease the indentation of the lines that
+    follow, and `EOL` ends the current line."""
+
+    # Default size (in characters) of the chunks written to outputs
+    CHUNK_SIZE: int = 64 * 1024
+
+    def __init__(self, stream: TOutput, indent: str = "\t"):
         self.stream = stream
+        self.indent = indent
 
-    def write(self, output: StringIO):
-        for atom in self:
-            output.write(atom)
+    def write(self, output: TextIO, chunkSize: int = CHUNK_SIZE) -> TextIO:
+        """Writes the output to the given text stream (file, `StringIO`,
+        socket file, etc) in chunks of at least `chunkSize` characters."""
+        for chunk in self.chunks(chunkSize):
+            output.write(chunk)
         return output
 
-    def __iter__(self):
+    def writeFD(self, fd: int, chunkSize: int = CHUNK_SIZE, encoding: str = "utf8"):
+        """Writes the output directly to the given file descriptor (which
+        may be a socket's), bypassing any Python-level buffering."""
+        for chunk in self.chunks(chunkSize):
+            data = memoryview(chunk.encode(encoding))
+            while data:
+                data = data[os.write(fd, data) :]
+        return fd
+
+    def chunks(self, chunkSize: int = CHUNK_SIZE) -> Iterator[str]:
+        """Iterates on the output in strings of at least `chunkSize`
+        characters (except the last one), so that memory use is
+        bounded by the chunk size and not by the size of the output."""
+        buffer: list[str] = []
+        size = 0
+        for atom in self:
+            buffer.append(atom)
+            size += len(atom)
+            if size >= chunkSize:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+
+    def __iter__(self) -> Iterator[str]:
+        depth = 0
+        prefix = ""
+        isLineStart = True
         for atom in self.stream:
             if atom is EOL:
+                isLineStart = True
                 yield atom.value
-            elif isinstance(atom, Control):
-                pass
-            else:
+            elif atom is START:
+                depth += 1
+                prefix = self.indent * depth
+            elif atom is END:
+                depth -= 1
+                prefix = self.indent * depth
+            elif atom:
+                if isLineStart:
+                    isLineStart = False
+                    if prefix:
+                        yield prefix
                 yield atom
 
     def __str__(self) -> str:
-        res = StringIO()
-        self.write(res)
-        res.seek(0)
-        return res.read()
+        return "".join(self)
 
 
 class Backend:
-    def on(self, value: Union[Value, Application]) -> TOutput:
+    """Backends translate model values and applications to a stream of
+    output atoms. Backend methods are generators, so that the output is
+    produced lazily as it is written. Handlers emit their operands by
+    yielding them: they are expanded by `walk.expand`, so that arbitrarily
+    deep trees don't recurse.
+
+    Applications are dispatched on their operator and the types of their
+    first two operands. Handlers defined for an `Operation` with `define()`
+    apply to operands of the operation's types or any of their subtypes,
+    otherwise the backend's method for the operator (as given in
+    `Backend.Operators`) is used. Resolved handlers are memoized.
+
+    Before being emitted, trees are rewritten by the backend's `passes`,
+    which fold constants by default.
+
+    When the backend has a `cache`, outputs are stored by the digest of the
+    tree and the backend's `fingerprint`. The `Version` must be bumped when
+    a backend's output changes for a same tree."""
+
+    Version: str = "1"
+
+    # Name of the backend method implementing each operator
+    Operators: dict[Operator, str] = {
+        Operator.Not: "not_",
+        Operator.Add: "add",
+        Operator.Sub: "sub",
+        Operator.Mul: "mul",
+        Operator.Div: "div",
+        Operator.Mod: "mod",
+        Operator.Pow: "pow",
+        Operator.Or: "or_",
+        Operator.Eq: "eq",
+        Operator.Is: "is_",
+        Operator.Gt: "gt",
+        Operator.Lt: "lt",
+        Operator.And: "and_",
+        Operator.Index: "index",
+        Operator.Access: "access",
+        Operator.Slice: "slice",
+        Operator.Cond: "cond",
+    }
+
+    def __init__(
+        self, passes: Optional[Iterable[Callable[[Expression], Expression]]] = None
+    ):
+        # Passes applied to trees before they are emitted
+        self.passes: list[Callable[[Expression], Expression]] = (
+            [Fold()] if passes is None else list(passes)
+        )
+        # Optional cache of outputs
+        self.cache: Optional["Cache"] = None
+        # Handlers defined for specific operations, by operation key
+        self.operations: dict[str, Callable[..., TOutput]] = {}
+        # Memoized handlers by (operator, ltype, rtype)
+        self.dispatch: dict[
+            tuple[Union[Operator, str], Optional[Type], Optional[Type]],
+            Callable[..., TOutput],
+        ] = {}
+
+    def __getstate__(self):
+        # The memoized dispatch holds bound methods, and is rebuilt on use
+        state = self.__dict__.copy()
+        state["dispatch"] = {}
+        return state
+
+    @staticmethod
+    def Identify(handler: Callable) -> str:
+        """Returns a string identifying the given handler: its name and a
+        digest of its code and constants, which changes with the handler
+        (unlike the name, as all lambdas are `<lambda>`)."""
+        import hashlib
+
+        name = getattr(handler, "__qualname__", handler.__class__.__qualname__)
+        code = getattr(handler, "__code__", None)
+        if code is None:
+            return name
+        digest = hashlib.sha256()
+        pending = [code]
+        while pending:
+            current = pending.pop()
+            digest.update(current.co_code)
+            for _ in current.co_consts:
+                # NOTE: Nested code objects (lambdas, comprehensions) are
+                # hashed too, as their `repr` has their address.
+                if hasattr(_, "co_code"):
+                    pending.append(_)
+                elif isinstance(_, frozenset):
+                    # The order of sets depends on the hash seed
+                    digest.update(repr(sorted(repr(v) for v in _)).encode("utf8"))
+                else:
+                    digest.update(repr(_).encode("utf8"))
+            digest.update(" ".join(current.co_names).encode("utf8"))
+        return f"{name}#{digest.hexdigest()[:16]}"
+
+    def fingerprint(self) -> str:
+        """Returns a string identifying the backend's output for a given
+        tree: its class, version, passes (with their configuration) and
+        defined operations."""
+        return "|".join(
+            (
+                f"{self.__class__.__module__}.{self.__class__.__qualname__}",
+                self.Version,
+                ",".join(
+                    (
+                        _.fingerprint()
+                        if hasattr(_, "fingerprint")
+                        else _.__class__.__qualname__
+                    )
+                    for _ in self.passes
+                ),
+                ",".join(
+                    f"{k}={Backend.Identify(v)}"
+                    for k, v in sorted(self.operations.items())
+                ),
+            )
+        )
+
+    def define(self, operation: Operation, handler: Callable[..., TOutput]):
+        """Defines the handler for the given operation, which is called with
+        the application's values."""
+        self.operations[operation.key] = handler
+        self.dispatch.clear()
+        return self
+
+    def resolve(
+        self,
+        name: Union[Operator, str],
+        ltype: Optional[Type],
+        rtype: Optional[Type] = None,
+    ) -> Callable[..., TOutput]:
+        """Returns the handler for the given operator applied to values of
+        the given types."""
+        key = (name, ltype, rtype)
+        handler = self.dispatch.get(key)
+        if handler is None:
+            handler = self.dispatch[key] = self._resolve(name, ltype, rtype)
+        return handler
+
+    def _resolve(
+        self,
+        name: Union[Operator, str],
+        ltype: Optional[Type],
+        rtype: Optional[Type],
+    ) -> Callable[..., TOutput]:
+        if self.operations and ltype:
+            # We look for the most specific operation, walking up the
+            # types' ancestors, the closest first.
+            for l in ltype.lineage():
+                for r in rtype.lineage() if rtype else (None,):
+                    handler = self.operations.get(Operation.Key(name, l, r))
+                    if handler:
+                        return handler
+        method = (
+            getattr(self, self.Operators[name], None)
+            if name in self.Operators
+            else None
+        )
+        if method is None:
+            raise RuntimeError(f"Operation '{name}' not implemented in backend: {self}")
+        return method
+
+    def on(self, value: Expression) -> TOutput:
+        """Returns the output for the given node only, see `emit`."""
         if isinstance(value, Application):
             return self.application(value)
         elif isinstance(value, Value):
@@ -51,25 +266,79 @@ class Backend:
             raise ValueError(f"Expected Value or Application, got: {value}")
 
     def value(self, value: Value) -> TOutput:
-        raise NotImplemented
+        raise NotImplementedError
 
     def application(self, application: Application) -> TOutput:
-        name = application.name
-        if name is Operator.Add:
-            return self.add(application[0], application[1])
-        elif name is Operator.Index:
-            return self.index(application[0], application[1])
-        else:
-            raise RuntimeError("Operation '{name}' not implemented in backend: {self}")
+        values = application.values
+        return self.resolve(
+            application.name,
+            values[0].type if values else None,
+            values[1].type if len(values) > 1 else None,
+        )(*values)
 
     def add(self, value: Value, rvalue: Value) -> TOutput:
-        raise NotImplemented
+        raise NotImplementedError
 
     def index(self, value: Value, rvalue: Value) -> TOutput:
-        raise NotImplemented
+        raise NotImplementedError
+
+    def optimize(self, value: Expression) -> Expression:
+        """Returns the given tree rewritten by the backend's passes."""
+        for rewrite in self.passes:
+            value = rewrite(value)
+        return value
+
+    def emit(self, value: Expression) -> Iterator[Union[str, Control]]:
+        """Returns the complete output for the given node."""
+        return expand(self.on, value)
+
+    def __call__(self, value: Expression) -> Output:
+        if self.cache is None:
+            return Output(self.emit(self.optimize(value)))
+        from .cache import key as cacheKey
+
+        key = cacheKey(value, self.fingerprint())
+        res = self.cache.get(key)
+        if res is None:
+            res = str(Output(self.emit(self.optimize(value))))
+            self.cache.set(key, res)
+        return Output((res,))
+
+
+# --
+# ## Registry
+#
+# Backends are registered by name with the `module:attribute` path of their
+# instance, and are only imported on first use, so that importing `tame`
+# doesn't import every backend (and their dependencies).
+
+Backends: dict[str, str] = {
+    "c": "tame.backends.c:C",
+    "numpy": "tame.backends.numpy:NumPy",
+}
+Loaded: dict[str, Backend] = {}
+
+
+def register(name: str, path: str):
+    """Registers the backend instance at the given `module:attribute` path
+    under the given name, replacing any previous one."""
+    assert ":" in path, f"Expected 'module:attribute' path, got: {path}"
+    Backends[name] = path
+    Loaded.pop(name, None)
+
 
-    def __call__(self, value: Union[Value, Application]) -> Output:
-        return Output(self.on(value))
+def backend(name: str) -> Backend:
+    """Returns the backend registered with the given name, importing its
+    module on first use."""
+    res = Loaded.get(name)
+    if res is None:
+        if name not in Backends:
+            raise KeyError(
+                f"No backend registered as '{name}', got: {', '.join(Backends)}"
+            )
+        module, attribute = Backends[name].split(":", 1)
+        res = Loaded[name] = getattr(import_module(module), attribute)
+    return res
 
 
 # EOF
@@ -1,25 +1,307 @@
-from ..model import Value
-from ..api import NaturalNumber
-from . import Backend, TOutput
+from ..model import (
+    Expression,
+    Value,
+    Literal,
+    Application,
+    Operator,
+    Sequence,
+    Structure,
+    Type,
+)
+from .. import api
+from . import Backend, Output, TOutput, Control, START, END, EOL
+from .passes import Fold, CSE, Temporary, Elements
+from .walk import expand, postorder
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 T = None
 
 
 class CBackend(Backend):
+    # C operators and their precedence, higher binds tighter
+    Precedence: dict[Operator, int] = {
+        Operator.Index: 15,
+        Operator.Access: 15,
+        Operator.Not: 14,
+        Operator.Mul: 13,
+        Operator.Div: 13,
+        Operator.Mod: 13,
+        Operator.Add: 12,
+        Operator.Sub: 12,
+        Operator.Gt: 10,
+        Operator.Lt: 10,
+        Operator.Eq: 9,
+        Operator.Is: 9,
+        Operator.And: 5,
+        Operator.Or: 4,
+        Operator.Cond: 3,
+    }
+    Symbols: dict[Operator, str] = {
+        Operator.Not: "!",
+        Operator.Add: " + ",
+        Operator.Sub: " - ",
+        Operator.Mul: " * ",
+        Operator.Div: " / ",
+        Operator.Mod: " % ",
+        Operator.Or: " || ",
+        Operator.And: " && ",
+        Operator.Eq: " == ",
+        Operator.Is: " == ",
+        Operator.Gt: " > ",
+        Operator.Lt: " < ",
+        Operator.Access: ".",
+    }
+
+    def __init__(
+        self,
+        passes: Optional[Iterable[Callable[[Expression], Expression]]] = None,
+        scoped: Optional[Iterable[Callable[[Expression], Expression]]] = None,
+    ):
+        super().__init__(passes)
+        # Passes that introduce temporaries, which need a statement scope,
+        # and are thus only applied to functions (see `kernel`).
+        self.scoped: list[Callable[[Expression], Expression]] = (
+            [CSE()] if scoped is None else list(scoped)
+        )
+
+    def ctype(self, type: Optional[Type], structure: Structure) -> str:
+        """Returns the C type for a scalar of the given type and structure."""
+        if type and type.isa(api.DecimalNumber):
+            if structure.size == 32:
+                return "float"
+            elif structure.size == 64:
+                return "double"
+        elif structure.size in (8, 16, 32, 64):
+            return f"int{structure.size}_t"
+        raise ValueError(f"Unsupported scalar type {type} with structure {structure}")
+
+    def emit(self, value: Expression) -> Iterator[Union[str, Control]]:
+        # Temporaries introduced by CSE (when given in `passes`) are
+        # declared first, in order
+        for temporary in Temporary.Collect(value):
+            yield from self.declaration(temporary)
+        yield from expand(self.on, value)
+
+    def declaration(self, temporary: Temporary) -> Iterator[Union[str, Control]]:
+        yield f"const {self.ctype(temporary.type, temporary.structure)} "
+        yield temporary.name
+        yield " = "
+        yield from expand(self.on, temporary.definition)
+        yield ";"
+        yield EOL
+
+    def prelude(self) -> Output:
+        """Returns the includes required by the emitted code."""
+        return Output(
+            atom
+            for _ in ("stddef.h", "stdint.h", "math.h")
+            for atom in (f"#include <{_}>", EOL)
+        )
+
+    def kernel(self, name: str, value: Expression, alignment: int = 0) -> Output:
+        """Returns the definition of a C function `name` that computes the
+        given tree. The named values referenced by the tree are the
+        function's parameters, sequences being passed as `restrict`
+        pointers so that the compiler can assume they don't alias. When the
+        result is a sequence, it is written to the `out` parameter by a
+        single loop, all element-wise operations being fused in the loop
+        body. When `alignment` is given, sequences are assumed to be
+        aligned on that many bytes."""
+        return Output(self.function(name, self.optimizeFunction(value), alignment))
+
+    def optimizeFunction(self, value: Expression) -> Expression:
+        """Returns the given tree rewritten by the backend's passes, and
+        then by the `scoped` passes, to be the body of a function."""
+        value = self.optimize(value)
+        for rewrite in self.scoped:
+            value = rewrite(value)
+        return value
+
+    def function(
+        self, name: str, value: Expression, alignment: int = 0
+    ) -> Iterator[Union[str, Control]]:
+        temporaries = Temporary.Collect(value)
+        parameters = self.parameters(value, temporaries)
+        isSequence = isinstance(value.structure, Sequence)
+        index = Value(api.NaturalNumber, api.B64, "_i")
+        arrays = [_.name for _ in parameters if isinstance(_.structure, Sequence)]
+        # Signature
+        yield "void" if isSequence else self.ctype(value.type, value.structure)
+        yield f" {name}("
+        for i, parameter in enumerate(parameters):
+            if i:
+                yield ", "
+            yield from self.parameter(parameter, index)
+        if isSequence:
+            yield ", " if parameters else ""
+            yield f"{self.itemType(value, index)}* restrict out"
+            arrays.append("out")
+        elif not parameters:
+            yield "void"
+        yield ") {"
+        yield START
+        yield EOL
+        # Alignment hints
+        if alignment and arrays:
+            yield "#if defined(__GNUC__)"
+            yield EOL
+            for _ in arrays:
+                yield f"{_} = __builtin_assume_aligned({_}, {alignment});"
+                yield EOL
+            yield "#endif"
+            yield EOL
+        # Body
+        for temporary in temporaries:
+            yield from self.declaration(temporary)
+        if isSequence:
+            yield f"for (size_t {index.name} = 0; {index.name} < {value.structure.length}; {index.name}++) {{"
+            yield START
+            yield EOL
+            yield f"out[{index.name}] = "
+            yield from expand(self.on, Elements(index)(value))
+            yield ";"
+            yield END
+            yield EOL
+            yield "}"
+        else:
+            yield "return "
+            yield from expand(self.on, value)
+            yield ";"
+        yield END
+        yield EOL
+        yield "}"
+        yield EOL
+
+    def parameters(
+        self, value: Expression, temporaries: list[Temporary]
+    ) -> list[Value]:
+        """Returns the named values referenced by the given tree and
+        temporaries, in order of appearance."""
+        res: dict[int, Value] = {}
+        for root in (*(_.definition for _ in temporaries), value):
+            for node in postorder(root):
+                if (
+                    isinstance(node, Value)
+                    and not isinstance(node, (Literal, Temporary))
+                    and id(node) not in res
+                ):
+                    res[id(node)] = node
+        return list(res.values())
+
+    def parameter(self, value: Value, index: Value) -> Iterator[str]:
+        if isinstance(value.structure, Sequence):
+            yield f"const {self.itemType(value, index)}* restrict "
+        else:
+            yield f"{self.ctype(value.type, value.structure)} "
+        yield from self.value(value)
+
+    def itemType(self, value: Expression, index: Value) -> str:
+        """Returns the C type of the items of the given sequence."""
+        item = Application(Operator.Index, value, index)
+        return self.ctype(item.type, item.structure)
+
     def value(self, value: Value) -> TOutput:
-        return f"{value.value}"
+        if isinstance(value, Literal):
+            yield f"{value.value}"
+        elif value.name:
+            yield value.name
+        else:
+            raise ValueError(f"Value needs a name to be referenced, got: {value}")
+
+    def operand(
+        self, value: Expression, precedence: int, isRight: bool = False
+    ) -> TOutput:
+        """Outputs the given operand of an operator of the given precedence,
+        in parentheses if needed so that the evaluation order is that of
+        the model. Operators are left-associative."""
+        if isinstance(value, Application):
+            p = self.Precedence.get(value.name, 16)
+            if p < precedence or (isRight and p == precedence):
+                yield "("
+                yield value
+                yield ")"
+                return
+        yield value
+
+    def prefix(self, name: Operator, value: Expression) -> TOutput:
+        yield self.Symbols[name]
+        yield from self.operand(value, self.Precedence[name])
 
-    def add(self, lvalue: Value, rvalue: Value):
-        return f"{self.value(lvalue)} + {self.value(rvalue)}"
+    def infix(self, name: Operator, lvalue: Expression, rvalue: Expression) -> TOutput:
+        precedence = self.Precedence[name]
+        yield from self.operand(lvalue, precedence)
+        yield self.Symbols[name]
+        yield from self.operand(rvalue, precedence, True)
 
-    def index(self, lvalue: Value, rvalue: Value):
+    def not_(self, value: Value) -> TOutput:
+        return self.prefix(Operator.Not, value)
+
+    def add(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Add, lvalue, rvalue)
+
+    def sub(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Sub, lvalue, rvalue)
+
+    def mul(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Mul, lvalue, rvalue)
+
+    def div(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Div, lvalue, rvalue)
+
+    def mod(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Mod, lvalue, rvalue)
+
+    def pow(self, lvalue: Value, rvalue: Value) -> TOutput:
+        # NOTE: This requires `math.h`
+        yield "pow("
+        yield lvalue
+        yield ", "
+        yield rvalue
+        yield ")"
+
+    def or_(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Or, lvalue, rvalue)
+
+    def and_(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.And, lvalue, rvalue)
+
+    def eq(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Eq, lvalue, rvalue)
+
+    def is_(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Is, lvalue, rvalue)
+
+    def gt(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Gt, lvalue, rvalue)
+
+    def lt(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Lt, lvalue, rvalue)
+
+    def index(self, lvalue: Value, rvalue: Value) -> TOutput:
         if isinstance(lvalue.structure, Sequence):
-            if rvalue.type.isa(NaturalNumber):
-                return f"OK"
+            if rvalue.type.isa(api.NaturalNumber):
+                yield from self.operand(lvalue, self.Precedence[Operator.Index])
+                yield "["
+                yield rvalue
+                yield "]"
             else:
                 raise ValueError(f"Unsupported indexing value: {rvalue}")
         else:
-            raise ValueError(f"Unsupported indexed value: {rvalue}")
+            raise ValueError(f"Unsupported indexed value: {lvalue}")
+
+    def access(self, lvalue: Value, rvalue: Value) -> TOutput:
+        return self.infix(Operator.Access, lvalue, rvalue)
+
+    def slice(self, lvalue: Value, *rvalue: Value) -> TOutput:
+        raise ValueError(f"Slices are not supported in C, got: {lvalue}")
+
+    def cond(self, value: Value, lvalue: Value, rvalue: Value) -> TOutput:
+        precedence = self.Precedence[Operator.Cond]
+        yield from self.operand(value, precedence + 1)
+        yield " ? "
+        yield from self.operand(lvalue, precedence + 1)
+        yield " : "
+        yield from self.operand(rvalue, precedence)
 
 
 C = CBackend()
@@ -0,0 +1,139 @@
+from ..model import Expression, Value, Literal, Application, Operator
+from .walk import Visitor
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import hashlib
+import os
+
+# --
+# ## Output cache
+#
+# Backends can be given a `Cache`, in which case their output is stored
+# by the digest of the tree and the backend's fingerprint, so that the
+# output of unchanged trees is a lookup instead of an emission.
+
+
+class Digest(Visitor[bytes]):
+    """Computes a structural digest of a tree that is stable across
+    processes: it only depends on the operators, the type keys, the
+    structures, and the literal values and value names."""
+
+    def visit(self, node: Expression, values: tuple[bytes, ...]) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(node, Application):
+            name = node.name
+            h.update(b"A")
+            h.update((name.value if isinstance(name, Operator) else name).encode())
+            for _ in values:
+                h.update(_)
+        elif isinstance(node, Literal):
+            h.update(b"L")
+            h.update(f"{node.type.key}{node.structure}".encode())
+            h.update(f"{node.value.__class__.__name__}:{node.value!r}".encode())
+        elif isinstance(node, Value):
+            h.update(b"V")
+            h.update(f"{node.type.key}{node.structure}:{node.name}".encode())
+        return h.digest()
+
+
+def key(value: Expression, fingerprint: str) -> str:
+    """Returns the cache key of the output of the given tree by a backend
+    with the given fingerprint."""
+    return hashlib.blake2b(
+        f"{digest(value)}|{fingerprint}".encode("utf8"), digest_size=16
+    ).hexdigest()
+
+
+def digest(value: Expression) -> str:
+    """Returns the stable structural digest of the given tree."""
+    return Digest()(value).hex()
+
+
+class Cache:
+    """A two-tier cache of outputs: an in-memory LRU of up to `capacity`
+    entries, and when `path` is given, a directory of files of up to
+    `size` bytes in total, where the least recently used files are
+    evicted first."""
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        path: Optional[Path] = None,
+        size: int = 256 * 1024 * 1024,
+    ):
+        self.capacity = capacity
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.path = Path(path) if path else None
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.used = sum(_.stat().st_size for _ in self.path.iterdir())
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        elif self.path and (path := self.path / key).exists():
+            try:
+                res = path.read_text("utf8")
+                # We touch the file so that eviction is least recently used
+                os.utime(path)
+            except FileNotFoundError:
+                # The file was evicted by another process in the meantime
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(key, res)
+            return res
+        else:
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        self.remember(key, value)
+        if self.path:
+            data = value.encode("utf8")
+            tmp = self.path / f".{key}.{os.getpid()}"
+            tmp.write_bytes(data)
+            os.replace(tmp, self.path / key)
+            self.used += len(data)
+            if self.used > self.size:
+                self.evict()
+        return self
+
+    def remember(self, key: str, value: str):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def evict(self):
+        """Removes the least recently used files until the directory is
+        below 90% of its size."""
+        files = sorted(
+            ((_.stat(), _) for _ in self.path.iterdir() if _.is_file()),
+            key=lambda _: _[0].st_mtime,
+        )
+        self.used = sum(_[0].st_size for _ in files)
+        for stat, path in files:
+            if self.used <= self.size * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.used -= stat.st_size
+        return self
+
+    def clear(self):
+        self.entries.clear()
+        if self.path:
+            for _ in self.path.iterdir():
+                _.unlink(missing_ok=True)
+            self.used = 0
+        return self
+
+
+# EOF
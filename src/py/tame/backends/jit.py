@@ -0,0 +1,227 @@
+from ..model import Expression, Value, Sequence
+from .. import api
+from . import Output
+from .c import CBackend, C
+from .passes import Temporary
+from typing import Optional
+from array import array
+from pathlib import Path
+import ctypes
+import hashlib
+import os
+import platform
+import subprocess
+import tempfile
+
+# --
+# ## C JIT
+#
+# Compiles trees to native code with the system C compiler, loading the
+# resulting shared object with `ctypes`. Shared objects are cached on disk
+# by the hash of their source, compiler command, compiler version and host
+# (as the default flags target the host's CPU), so that unchanged kernels
+# are only compiled once.
+
+# The `ctypes` type and `array` typecode for each C scalar type
+CTypes: dict[str, tuple[type, str]] = {
+    "int8_t": (ctypes.c_int8, "b"),
+    "int16_t": (ctypes.c_int16, "h"),
+    "int32_t": (ctypes.c_int32, "i" if array("i").itemsize == 4 else "l"),
+    "int64_t": (ctypes.c_int64, "q"),
+    "float": (ctypes.c_float, "f"),
+    "double": (ctypes.c_double, "d"),
+}
+
+# The kind of the items of each buffer format (signed, unsigned, float)
+Kinds: dict[str, str] = {
+    **{_: "i" for _ in "bhilqn"},
+    **{_: "u" for _ in "BHILQN"},
+    **{_: "f" for _ in "efd"},
+}
+
+# Shared objects already loaded in this process, by key
+Libraries: dict[str, ctypes.CDLL] = {}
+
+# Version strings of the compilers, by command
+Versions: dict[str, str] = {}
+
+
+def cachePath() -> Path:
+    """Returns the directory where compiled kernels are cached, which is
+    `$TAME_CACHE` or `~/.cache/tame/jit`."""
+    path = os.environ.get("TAME_CACHE")
+    return Path(path) if path else Path.home() / ".cache" / "tame" / "jit"
+
+
+class Kernel:
+    """A compiled kernel, called with the kernel's parameters (positionally
+    or by name). Sequence parameters accept any buffer of the right item
+    type (`array`, NumPy arrays, etc) or a list, and sequence results are
+    returned as an `array`, or written to the given `out` buffer."""
+
+    def __init__(
+        self,
+        function: ctypes._CFuncPtr,
+        parameters: list[Value],
+        result: Expression,
+        backend: CBackend,
+    ):
+        self.function = function
+        self.parameters = parameters
+        self.result = result
+        self.names = [_.name for _ in parameters]
+        self.types = [self.ctype(_, backend) for _ in parameters]
+        self.resultType = self.ctype(result, backend)
+        function.argtypes = [
+            ctypes.c_void_p if isinstance(_.structure, Sequence) else t[0]
+            for _, t in zip(parameters, self.types)
+        ] + ([ctypes.c_void_p] if self.isSequence else [])
+        function.restype = None if self.isSequence else self.resultType[0]
+
+    @property
+    def isSequence(self) -> bool:
+        return isinstance(self.result.structure, Sequence)
+
+    def ctype(self, value: Expression, backend: CBackend) -> tuple[type, str]:
+        if isinstance(value.structure, Sequence):
+            return CTypes[
+                backend.itemType(value, Value(api.NaturalNumber, api.B64, "_i"))
+            ]
+        else:
+            return CTypes[backend.ctype(value.type, value.structure)]
+
+    def buffer(
+        self, value, parameter: Expression, typecode: str, isWritable: bool = False
+    ) -> tuple[object, int]:
+        """Returns the given value as an object exposing a buffer (kept to
+        ensure the memory stays alive) and the address of its data. Input
+        buffers of another item type are converted, raising a `ValueError`
+        when their items don't fit."""
+        if isinstance(value, (list, tuple)):
+            value = array(typecode, value)
+        itemsize = array(typecode).itemsize
+        view = memoryview(value)
+        format = view.format.lstrip("@")
+        if view.itemsize != itemsize or Kinds.get(format) != Kinds[typecode]:
+            assert (
+                not isWritable
+            ), f"Output buffer has items {format!r}, expected {typecode!r}: {value}"
+            try:
+                value = array(typecode, view.cast("B").cast(format).tolist())
+            except (TypeError, ValueError, OverflowError) as e:
+                raise ValueError(
+                    f"Could not convert items {format!r} to {typecode!r} for {parameter}: {e}"
+                ) from e
+        view = memoryview(value).cast("B")
+        length = parameter.structure.length * itemsize
+        assert (
+            view.nbytes >= length
+        ), f"Expected at least {length} bytes for {parameter}, got: {view.nbytes}"
+        if view.readonly:
+            assert not isWritable, f"Output buffer is read-only: {value}"
+            value = array(typecode, bytes(view))
+            view = memoryview(value).cast("B")
+        return value, ctypes.addressof(ctypes.c_char.from_buffer(view))
+
+    def __call__(self, *args, out=None, **kwargs):
+        values = list(args) + [kwargs[_] for _ in self.names[len(args) :]]
+        assert len(values) == len(
+            self.parameters
+        ), f"Expected parameters {self.names}, got: {values}"
+        arguments = []
+        buffers = []
+        for value, parameter, (ctype, typecode) in zip(
+            values, self.parameters, self.types
+        ):
+            if isinstance(parameter.structure, Sequence):
+                buffer, address = self.buffer(value, parameter, typecode)
+                buffers.append(buffer)
+                arguments.append(address)
+            else:
+                arguments.append(value)
+        if self.isSequence:
+            typecode = self.resultType[1]
+            if out is None:
+                out = array(
+                    typecode,
+                    bytes(self.result.structure.length * array(typecode).itemsize),
+                )
+            buffer, address = self.buffer(out, self.result, typecode, True)
+            self.function(*arguments, address)
+            return out
+        else:
+            return self.function(*arguments)
+
+
+def build(
+    source: str,
+    flags: tuple[str, ...] = ("-O3", "-march=native"),
+    compiler: Optional[str] = None,
+) -> ctypes.CDLL:
+    """Compiles the given C source into a shared object that is loaded and
+    returned, reusing the cached one if the source, compiler command and
+    version, and host haven't changed."""
+    command = [compiler or os.environ.get("CC", "cc"), *flags, "-shared", "-fPIC"]
+    key = hashlib.sha256(
+        "\0".join(
+            [*command, version(command[0]), platform.node(), platform.machine(), source]
+        ).encode("utf8")
+    ).hexdigest()
+    if key in Libraries:
+        return Libraries[key]
+    path = cachePath() / f"{key}.so"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+            src = Path(tmp) / f"{key}.c"
+            obj = Path(tmp) / f"{key}.so"
+            src.write_text(source)
+            res = subprocess.run(
+                [*command, "-o", str(obj), str(src), "-lm"],
+                capture_output=True,
+                text=True,
+            )
+            if res.returncode != 0:
+                raise RuntimeError(f"Could not compile kernel: {res.stderr}")
+            # NOTE: The rename is atomic, so concurrent compilations of the
+            # same kernel are safe.
+            os.replace(obj, path)
+    library = Libraries[key] = ctypes.CDLL(str(path))
+    return library
+
+
+def version(compiler: str) -> str:
+    """Returns the version string of the given compiler command."""
+    if compiler not in Versions:
+        try:
+            res = subprocess.run(
+                [compiler, "--version"], capture_output=True, text=True
+            )
+            Versions[compiler] = res.stdout.strip()
+        except OSError:
+            # NOTE: The compilation itself reports the missing compiler
+            Versions[compiler] = ""
+    return Versions[compiler]
+
+
+def jit(
+    value: Expression,
+    name: str = "tame_kernel",
+    flags: tuple[str, ...] = ("-O3", "-march=native"),
+    compiler: Optional[str] = None,
+    backend: CBackend = C,
+) -> Kernel:
+    """Emits the given tree as a C kernel (see `CBackend.kernel`), compiles
+    it and returns it as a Python callable."""
+    tree = backend.optimizeFunction(value)
+    source = str(backend.prelude()) + str(Output(backend.function(name, tree)))
+    library = build(source, flags, compiler)
+    return Kernel(
+        getattr(library, name),
+        backend.parameters(tree, Temporary.Collect(tree)),
+        tree,
+        backend,
+    )
+
+
+# EOF
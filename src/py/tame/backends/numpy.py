@@ -0,0 +1,181 @@
+from ..model import (
+    Expression,
+    Value,
+    Literal,
+    Application,
+    Operator,
+    Sequence,
+    Structure,
+    Type,
+)
+from .. import api
+from . import Backend
+from .walk import Visitor
+from typing import Callable, Iterable, Optional, Union
+import numpy as np
+
+# --
+# ## NumPy evaluator
+#
+# Evaluates model trees in-process, as a reference for the code emitted by
+# other backends. Every node evaluates to a 2D array whose first axis is
+# the batch, and second axis the elements of a sequence (of length 1 for
+# scalars), so that a whole batch of inputs is evaluated with one NumPy
+# operation per node.
+
+TArray = np.ndarray
+
+
+class NumPyBackend(Backend):
+    """A backend that evaluates trees with NumPy instead of emitting code.
+    Named values are given as keyword arguments when calling the backend,
+    either as a single value, or when `batch` is set, as an array of
+    values for each element of the batch."""
+
+    def __init__(
+        self, passes: Optional[Iterable[Callable[[Expression], Expression]]] = None
+    ):
+        # NOTE: By default the tree is evaluated as is, as it is meant as
+        # the reference for optimized output.
+        super().__init__([] if passes is None else passes)
+
+    def dtype(self, type: Optional[Type], structure: Structure) -> np.dtype:
+        """Returns the NumPy dtype for scalars (or sequence items) of the
+        given type and structure."""
+        if isinstance(structure, Sequence):
+            # NOTE: Like `CBackend.itemType`, the item type is that of an
+            # element of the sequence.
+            item = Application(
+                Operator.Index,
+                Value(type, structure),
+                Value(api.NaturalNumber, api.B64),
+            )
+            type, size = item.type, structure.itemSize
+        else:
+            size = structure.size
+        if type and type.isa(api.DecimalNumber):
+            if size in (16, 32, 64):
+                return np.dtype(f"float{size}")
+        elif size in (8, 16, 32, 64):
+            return np.dtype(f"int{size}")
+        raise ValueError(f"Unsupported scalar type {type} with structure {structure}")
+
+    def __call__(
+        self, value: Expression, batch: bool = False, **bindings: TArray
+    ) -> Union[TArray, np.generic]:
+        """Evaluates the given tree with the given named values. The result
+        is a scalar or a 1D array for a sequence, with an additional first
+        axis when `batch` is set."""
+        res = Evaluation(self, bindings, batch)(self.optimize(value))
+        if not isinstance(value.structure, Sequence):
+            res = res[:, 0]
+        return res if batch else res[0]
+
+    def not_(self, value: TArray) -> TArray:
+        return np.logical_not(value)
+
+    def add(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue + rvalue
+
+    def sub(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue - rvalue
+
+    def mul(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue * rvalue
+
+    def div(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        if lvalue.dtype.kind == "i" and rvalue.dtype.kind == "i":
+            # Like C, integer division rounds towards zero
+            q = np.abs(lvalue) // np.abs(rvalue)
+            return np.where((lvalue < 0) == (rvalue < 0), q, -q)
+        else:
+            return lvalue / rvalue
+
+    def mod(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        # Like C, the remainder has the sign of the dividend
+        return np.fmod(lvalue, rvalue)
+
+    def pow(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return np.power(lvalue, rvalue)
+
+    def or_(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return np.logical_or(lvalue, rvalue)
+
+    def and_(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return np.logical_and(lvalue, rvalue)
+
+    def eq(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue == rvalue
+
+    def is_(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue == rvalue
+
+    def gt(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue > rvalue
+
+    def lt(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        return lvalue < rvalue
+
+    def index(self, lvalue: TArray, rvalue: TArray) -> TArray:
+        index = np.broadcast_to(rvalue, (lvalue.shape[0], 1)).astype(np.intp)
+        return np.take_along_axis(lvalue, index, axis=1)
+
+    def cond(self, value: TArray, lvalue: TArray, rvalue: TArray) -> TArray:
+        return np.where(value, lvalue, rvalue)
+
+
+class Evaluation(Visitor[TArray]):
+    """Evaluates a tree bottom-up, dispatching applications through the
+    backend, and casting their results to the application's dtype. Values
+    are given by the bindings."""
+
+    def __init__(self, backend: NumPyBackend, bindings: dict[str, TArray], batch: bool):
+        self.backend = backend
+        self.bindings = bindings
+        self.batch = batch
+
+    def visit(self, node: Expression, values: tuple[TArray, ...]) -> TArray:
+        if isinstance(node, Application):
+            operands = node.values
+            res = self.backend.resolve(
+                node.name,
+                operands[0].type if operands else None,
+                operands[1].type if len(operands) > 1 else None,
+            )(*values)
+            if not node.structure:
+                return res
+            dtype = self.backend.dtype(node.type, node.structure)
+            name = node.name
+            if name in Application.Predicates:
+                # Truth values are integers, whatever their operands
+                return res.astype(dtype, copy=False)
+            # NOTE: The result is computed from the branches of a condition,
+            # the indexed sequence of an index, or otherwise all the
+            # operands, and a reference must not truncate them silently.
+            sources = (
+                values[1:]
+                if name is Operator.Cond
+                else values[:1] if name is Operator.Index else values
+            )
+            if dtype.kind != "f" and any(_.dtype.kind == "f" for _ in sources):
+                raise ValueError(
+                    f"Decimal operands would be truncated to {dtype}: {node}"
+                )
+            return res.astype(dtype, copy=False)
+        else:
+            return self.value(node)
+
+    def value(self, value: Value) -> TArray:
+        dtype = self.backend.dtype(value.type, value.structure)
+        if isinstance(value, Literal):
+            return np.full((1, 1), value.value, dtype)
+        elif value.name in self.bindings:
+            res = np.asarray(self.bindings[value.name], dtype)
+            res = res if self.batch else res[np.newaxis]
+            return res.reshape((res.shape[0], -1))
+        else:
+            raise ValueError(f"Missing binding for value: {value}")
+
+
+NumPy = NumPyBackend()
+# EOF
@@ -0,0 +1,336 @@
+from ..model import (
+    Expression,
+    Value,
+    Literal,
+    Application,
+    Operator,
+    Structure,
+    Sequence,
+    Type,
+)
+from .walk import Visitor, children, postorder
+from typing import Callable, Optional, Union
+import math
+import struct
+
+# --
+# ## Passes
+#
+# Passes rewrite expression trees before they are given to a backend. They
+# are bottom-up visitors, so the operands of an application are already
+# rewritten when the application is.
+
+
+class Pass(Visitor[Expression]):
+    """Rewrites a tree bottom-up: applications whose operands were rewritten
+    are rebuilt, and then given to `application`, values are given to
+    `value`. Both return the node to use in place of the given one."""
+
+    def visit(self, node: Expression, values: tuple[Expression, ...]) -> Expression:
+        if isinstance(node, Application):
+            if any(a is not b for a, b in zip(values, node.values)):
+                node = Application(node.name, *values)
+            return self.application(node)
+        else:
+            return self.value(node)
+
+    def value(self, value: Value) -> Expression:
+        return value
+
+    def application(self, application: Application) -> Expression:
+        return application
+
+    def fingerprint(self) -> str:
+        """Returns a string identifying the rewrite done by this pass, which
+        includes its configuration (see `Backend.fingerprint`)."""
+        return self.__class__.__qualname__
+
+
+TNumber = Union[int, float]
+
+
+def wrap(value: int, size: int) -> int:
+    """Wraps the given integer to a two's complement integer of `size`
+    bits, like the target would."""
+    mask = (1 << size) - 1
+    value &= mask
+    return value - (1 << size) if value >> (size - 1) else value
+
+
+def truncate(value: float, size: int) -> float:
+    """Rounds the given float to the precision of a `size` bits float."""
+    return struct.unpack("f", struct.pack("f", value))[0] if size == 32 else value
+
+
+def cdiv(a: int, b: int) -> int:
+    """Integer division rounding towards zero, like C."""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+class Fold(Pass):
+    """Folds applications of literals into literals, following the width of
+    their structure, removes identity operations (`x + 0`, `x * 1`, etc),
+    and reduces multiplications by 2 and small integer powers to additions
+    and multiplications."""
+
+    # Largest exponent that is reduced to multiplications
+    MaxPower: int = 16
+
+    Integer: dict[Operator, Callable[..., Optional[int]]] = {
+        Operator.Not: lambda a: int(not a),
+        Operator.Add: lambda a, b: a + b,
+        Operator.Sub: lambda a, b: a - b,
+        Operator.Mul: lambda a, b: a * b,
+        Operator.Div: lambda a, b: cdiv(a, b) if b else None,
+        Operator.Mod: lambda a, b: a - b * cdiv(a, b) if b else None,
+        Operator.Pow: lambda a, b: a**b if b >= 0 and b.bit_length() < 16 else None,
+        Operator.Or: lambda a, b: int(bool(a or b)),
+        Operator.And: lambda a, b: int(bool(a and b)),
+        Operator.Eq: lambda a, b: int(a == b),
+        Operator.Is: lambda a, b: int(a == b),
+        Operator.Gt: lambda a, b: int(a > b),
+        Operator.Lt: lambda a, b: int(a < b),
+    }
+
+    Float: dict[Operator, Callable[..., Optional[float]]] = {
+        Operator.Add: lambda a, b: a + b,
+        Operator.Sub: lambda a, b: a - b,
+        Operator.Mul: lambda a, b: a * b,
+        Operator.Div: lambda a, b: a / b if b else None,
+    }
+
+    def fingerprint(self) -> str:
+        return f"{self.__class__.__qualname__}(MaxPower={self.MaxPower})"
+
+    def application(self, application: Application) -> Expression:
+        values = application.values
+        numbers = [self.number(_) for _ in values]
+        if None not in numbers:
+            folded = self.fold(application, numbers)
+            if folded is not None:
+                return folded
+        elif application.arity == 2:
+            return self.simplify(application, *values, *numbers)
+        return application
+
+    def number(self, value: Expression) -> Optional[TNumber]:
+        """Returns the number held by the given node, if it's a numeric
+        literal."""
+        if isinstance(value, Literal) and isinstance(value.value, (int, float)):
+            return value.value
+        else:
+            return None
+
+    def fold(
+        self, application: Application, numbers: list[TNumber]
+    ) -> Optional[Literal]:
+        values: list[Literal] = application.values
+        structure: Structure = max((_.structure for _ in values), key=lambda _: _.size)
+        isInteger = all(isinstance(_, int) for _ in numbers)
+        operation = (self.Integer if isInteger else self.Float).get(application.name)
+        try:
+            res = operation(*numbers) if operation else None
+            if res is not None:
+                res = (
+                    wrap(res, structure.size)
+                    if isInteger
+                    else truncate(res, structure.size)
+                )
+        except (OverflowError, ValueError):
+            res = None
+        # NOTE: Infinities and NaNs have no literal syntax in the targets,
+        # so they are left to be computed.
+        if res is None or not (isInteger or math.isfinite(res)):
+            return None
+        return Literal(application.type or values[0].type, structure, res)
+
+    def simplify(
+        self,
+        application: Application,
+        lvalue: Expression,
+        rvalue: Expression,
+        lnumber: Optional[TNumber],
+        rnumber: Optional[TNumber],
+    ) -> Expression:
+        name = application.name
+        # NOTE: Literals are scalars, so operations on sequences can't
+        # be replaced by one.
+        isScalar = not isinstance(application.structure, Sequence)
+        if name is Operator.Add:
+            if rnumber == 0:
+                return lvalue
+            elif lnumber == 0:
+                return rvalue
+        elif name is Operator.Sub:
+            if rnumber == 0:
+                return lvalue
+        elif name is Operator.Mul:
+            if rnumber == 1:
+                return lvalue
+            elif lnumber == 1:
+                return rvalue
+            # NOTE: This is not true of floats, as `0.0 * inf` is `nan`
+            elif isScalar and (
+                (lnumber == 0 and isinstance(lnumber, int))
+                or (rnumber == 0 and isinstance(rnumber, int))
+            ):
+                return lvalue if lnumber is not None else rvalue
+            # NOTE: Shared sequences are not turned into temporaries, so
+            # this would compute them twice.
+            elif rnumber == 2 and isScalar:
+                return Application(Operator.Add, lvalue, lvalue)
+            elif lnumber == 2 and isScalar:
+                return Application(Operator.Add, rvalue, rvalue)
+        elif name is Operator.Div:
+            if rnumber == 1:
+                return lvalue
+        elif name is Operator.Pow:
+            if rnumber == 1:
+                return lvalue
+            elif rnumber == 0 and isScalar:
+                return Literal(rvalue.type, rvalue.structure, 1)
+            elif isinstance(rnumber, int) and 1 < rnumber <= self.MaxPower:
+                return self.power(lvalue, rnumber)
+        return application
+
+    def power(self, value: Expression, exponent: int) -> Expression:
+        """Returns the multiplications of `value` by itself equivalent to
+        `value ** exponent`, by repeated squaring."""
+        res: Optional[Expression] = None
+        while exponent:
+            if exponent & 1:
+                res = value if res is None else Application(Operator.Mul, res, value)
+            exponent >>= 1
+            if exponent:
+                value = Application(Operator.Mul, value, value)
+        return res
+
+
+class Temporary(Value):
+    """A value that stands for the result of an expression, so that the
+    expression can be computed once and then referenced. Temporaries are
+    numbered in the order they were created, so that a temporary's
+    definition only references temporaries with a lower index."""
+
+    __slots__ = ("index", "definition")
+
+    def __init__(
+        self,
+        index: int,
+        type: Optional[Type],
+        structure: Structure,
+        definition: Expression,
+    ):
+        super().__init__(type, structure)
+        self.index = index
+        self.name = f"_t{index}"
+        self.definition = definition
+
+    @staticmethod
+    def Collect(root: Expression) -> list["Temporary"]:
+        """Returns the temporaries referenced by the given tree, directly or
+        through other temporaries, in definition order."""
+        found: dict[int, Temporary] = {}
+        pending = [root]
+        while pending:
+            for node in postorder(pending.pop()):
+                if isinstance(node, Temporary) and node.index not in found:
+                    found[node.index] = node
+                    pending.append(node.definition)
+        return [found[_] for _ in sorted(found)]
+
+    def __repr__(self):
+        return f"({self.name}{self.type}{self.structure})"
+
+
+class CSE:
+    """Common subexpression elimination: applications that are structurally
+    equal (same operator, and structurally equal operands, literals being
+    equal if they have the same type, structure and value) and that are
+    used more than once are replaced by a `Temporary`."""
+
+    def __call__(self, root: Expression) -> Expression:
+        # We first map each node to a canonical node, the first one
+        # having its structural key.
+        canonical = Canonical()
+        root = canonical(root)
+        # We count the references to each canonical node
+        references: dict[int, int] = {}
+        for node in canonical.table.values():
+            for _ in children(node):
+                references[id(_)] = references.get(id(_), 0) + 1
+        shared = {k for k, v in references.items() if v > 1}
+        return Share(shared)(root) if shared else root
+
+
+class Canonical(Pass):
+    """Rewrites a tree so that structurally equal subtrees are the same
+    instance."""
+
+    def __init__(self):
+        self.table: dict[tuple, Expression] = {}
+
+    def value(self, value: Value) -> Expression:
+        if isinstance(value, Literal):
+            key = Literal.Key(value.type, value.structure, value.value)
+            try:
+                return self.table.setdefault(key, value)
+            except TypeError:
+                pass
+        return self.table.setdefault((value,), value)
+
+    def application(self, application: Application) -> Expression:
+        # NOTE: Operands are canonical, so they are compared by identity
+        key = Application.Key(application.name, *application.values)
+        return self.table.setdefault(key, application)
+
+
+class Share(Pass):
+    """Replaces the given (canonical) scalar applications by temporaries."""
+
+    def __init__(self, shared: set[int]):
+        self.shared = shared
+        self.count = 0
+
+    def visit(self, node: Expression, values: tuple[Expression, ...]) -> Expression:
+        res = super().visit(node, values)
+        # NOTE: The visitor keeps the original nodes alive, so their
+        # ids are stable.
+        if (
+            id(node) in self.shared
+            and isinstance(res, Application)
+            and res.structure is not None
+            and not isinstance(res.structure, Sequence)
+        ):
+            res = Temporary(self.count, res.type, res.structure, res)
+            self.count += 1
+        return res
+
+
+class Elements(Pass):
+    """Lowers element-wise applications on sequences to the application
+    on their elements at the given `index`, by indexing the sequence
+    values. The resulting tree computes one element of the result, which
+    fuses chained element-wise operations without intermediate
+    sequences."""
+
+    def __init__(self, index: Expression):
+        self.index = index
+
+    def visit(self, node: Expression, values: tuple[Expression, ...]) -> Expression:
+        # NOTE: The indexed operand of an existing index is accessed as a
+        # whole, not element-wise, so it is kept as is.
+        if isinstance(node, Application) and node.name is Operator.Index:
+            values = (node.values[0], *values[1:])
+        return super().visit(node, values)
+
+    def value(self, value: Value) -> Expression:
+        return (
+            Application(Operator.Index, value, self.index)
+            if isinstance(value.structure, Sequence)
+            else value
+        )
+
+
+# EOF
@@ -0,0 +1,260 @@
+from ..model import Expression, Application, Operator
+from ..universe import Universe
+from . import Backend, Control, TOutput
+from typing import Iterator, Optional, Union
+from time import perf_counter
+import json
+import os
+import threading
+
+# --
+# ## Profiling
+#
+# A `Profile` instruments backends while it is active, recording the nodes
+# emitted per operator, the time spent in each dispatched handler and pass,
+# the hit rates of the type and operation tables, and the output size. It
+# installs instrumented methods on the backend instances and instrumented
+# tables in the current universe, and removes them when it ends, so that
+# there is no overhead at all when no profile is active.
+#
+# ```
+# with Profile(C) as profile:
+#     str(C(tree))
+# print(profile.report())
+# profile.writeTrace("trace.json")
+# ```
+
+
+class Lookups(dict):
+    """A dictionary that counts the hits and misses of `get` and `in`."""
+
+    __slots__ = ("hits", "misses")
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key, default=None):
+        res = super().get(key, self)
+        if res is self:
+            self.misses += 1
+            return default
+        else:
+            self.hits += 1
+            return res
+
+    def __contains__(self, key) -> bool:
+        if super().__contains__(key):
+            self.hits += 1
+            return True
+        else:
+            self.misses += 1
+            return False
+
+
+class Profile:
+    """Records profiling counters and trace events for the given backends,
+    between `start()` and `stop()` (or within a `with` block)."""
+
+    # The universe tables that are instrumented, with their report name
+    Tables: dict[str, str] = {
+        "symbols": "Type.Symbols",
+        "instances": "Type.Instances",
+        "operations": "Operation.Registry",
+    }
+
+    def __init__(self, *backends: Backend):
+        self.backends = backends
+        # Nodes emitted, by operator (or node class for values)
+        self.counts: dict[str, int] = {}
+        # Time spent in handlers, and calls, by dispatch key
+        self.times: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        # Time spent in passes, by pass name
+        self.passes: dict[str, float] = {}
+        # Hits and misses of the instrumented tables and output caches
+        self.lookups: dict[str, list[int]] = {}
+        # Characters of emitted atoms (indentation excluded)
+        self.bytes: int = 0
+        # Complete trace events as (name, category, start, duration)
+        self.events: list[tuple[str, str, float, float]] = []
+        self.started: float = 0.0
+        self.elapsed: float = 0.0
+        self.universe: Optional[Universe] = None
+        self.caches: list[tuple[Backend, int, int]] = []
+
+    def start(self):
+        assert self.universe is None, "Profile already started"
+        self.universe = Universe.Get()
+        for field in self.Tables:
+            setattr(self.universe, field, Lookups(getattr(self.universe, field)))
+        for backend in self.backends:
+            self.instrument(backend)
+        self.started = perf_counter()
+        return self
+
+    def stop(self):
+        assert self.universe is not None, "Profile not started"
+        self.elapsed += perf_counter() - self.started
+        for field, name in self.Tables.items():
+            table = getattr(self.universe, field)
+            counts = self.lookups.setdefault(name, [0, 0])
+            counts[0] += table.hits
+            counts[1] += table.misses
+            setattr(self.universe, field, dict(table))
+        for backend in self.backends:
+            # Removing the instance attributes restores the class' methods
+            for _ in ("on", "emit", "optimize"):
+                backend.__dict__.pop(_, None)
+        for backend, hits, misses in self.caches:
+            counts = self.lookups.setdefault(
+                f"{backend.__class__.__name__}.cache", [0, 0]
+            )
+            counts[0] += backend.cache.hits - hits
+            counts[1] += backend.cache.misses - misses
+        self.caches = []
+        self.universe = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def instrument(self, backend: Backend):
+        """Installs the instrumented methods on the backend instance."""
+        on = backend.on
+        emit = backend.emit
+        optimize = backend.optimize
+        category = backend.__class__.__name__
+        if backend.cache is not None:
+            self.caches.append((backend, backend.cache.hits, backend.cache.misses))
+
+        def instrumentedOn(value: Expression) -> TOutput:
+            if isinstance(value, Application):
+                name = value.name
+                operator = name.name if isinstance(name, Operator) else name
+                # The dispatch key, as in `Backend.application`
+                key = ".".join(
+                    (
+                        name.value if isinstance(name, Operator) else name,
+                        *(_.type.key for _ in value.values[:2]),
+                    )
+                )
+            else:
+                operator = key = value.__class__.__name__
+            self.counts[operator] = self.counts.get(operator, 0) + 1
+            return self.timed(key, on(value))
+
+        def instrumentedEmit(value: Expression) -> Iterator[Union[str, Control]]:
+            started = perf_counter()
+            for atom in emit(value):
+                if atom.__class__ is str:
+                    self.bytes += len(atom)
+                elif atom is Control.EOL:
+                    self.bytes += 1
+                yield atom
+            self.event("emit", category, started)
+
+        def instrumentedOptimize(value: Expression) -> Expression:
+            for rewrite in backend.passes:
+                started = perf_counter()
+                value = rewrite(value)
+                name = rewrite.__class__.__name__
+                self.passes[name] = self.passes.get(name, 0.0) + self.event(
+                    name, "pass", started
+                )
+            return value
+
+        backend.on = instrumentedOn
+        backend.emit = instrumentedEmit
+        backend.optimize = instrumentedOptimize
+        return backend
+
+    def timed(self, key: str, atoms: TOutput) -> Iterator[Union[str, Control]]:
+        """Yields the atoms, adding the time spent producing them (but not
+        their operands) to the given key."""
+        elapsed = 0.0
+        iterator = iter(atoms)
+        while True:
+            started = perf_counter()
+            try:
+                atom = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += perf_counter() - started
+            yield atom
+        self.times[key] = self.times.get(key, 0.0) + elapsed
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def event(self, name: str, category: str, started: float) -> float:
+        duration = perf_counter() - started
+        self.events.append((name, category, started, duration))
+        return duration
+
+    def report(self) -> str:
+        """Returns a flat text report of the counters."""
+        lines: list[str] = [
+            f"Profile: {self.elapsed * 1000:.2f}ms, {self.bytes:,} bytes emitted"
+        ]
+        lines.append("")
+        lines.append(f"{'Operator':32s} {'Nodes':>10s}")
+        for name, count in sorted(self.counts.items(), key=lambda _: -_[1]):
+            lines.append(f"{name:32s} {count:10,}")
+        lines.append("")
+        lines.append(
+            f"{'Dispatch':48s} {'Calls':>10s} {'Total ms':>10s} {'Avg us':>8s}"
+        )
+        for key, elapsed in sorted(self.times.items(), key=lambda _: -_[1]):
+            calls = self.calls[key]
+            lines.append(
+                f"{key:48s} {calls:10,} {elapsed * 1000:10.3f} {elapsed / calls * 1e6:8.2f}"
+            )
+        if self.passes:
+            lines.append("")
+            lines.append(f"{'Pass':32s} {'Total ms':>10s}")
+            for name, elapsed in sorted(self.passes.items(), key=lambda _: -_[1]):
+                lines.append(f"{name:32s} {elapsed * 1000:10.3f}")
+        lines.append("")
+        lines.append(f"{'Lookups':32s} {'Hits':>10s} {'Misses':>10s} {'Rate':>6s}")
+        for name, (hits, misses) in self.lookups.items():
+            rate = hits / (hits + misses) if hits + misses else 0.0
+            lines.append(f"{name:32s} {hits:10,} {misses:10,} {rate:6.1%}")
+        return "\n".join(lines)
+
+    def trace(self) -> dict:
+        """Returns the recorded events in the Chrome trace event format
+        (see `chrome://tracing` or Perfetto), with the counters as
+        metadata."""
+        pid, tid = os.getpid(), threading.get_ident()
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": started * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": tid,
+                }
+                for name, category, started, duration in self.events
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "bytes": self.bytes,
+                "counts": self.counts,
+                "lookups": self.lookups,
+            },
+        }
+
+    def writeTrace(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump(self.trace(), f)
+        return path
+
+
+# EOF
@@ -0,0 +1,80 @@
+from ..model import Expression, Application
+from typing import Generic, Iterable, Iterator, TypeVar, Union, Callable
+
+R = TypeVar("R")
+
+# NOTE: Meta-programs easily produce applications that are tens of
+# thousands of levels deep (eg. reductions), so nothing here recurses:
+# the walkers keep their own stack.
+
+
+def children(node: Expression) -> tuple[Expression, ...]:
+    """Returns the operands of the given node, if any."""
+    return node.values if isinstance(node, Application) else ()
+
+
+def postorder(root: Expression) -> Iterator[Expression]:
+    """Iterates on the nodes of the given tree, operands first. Shared
+    subtrees are yielded once per occurrence."""
+    stack: list[tuple[Expression, int]] = [(root, 0)]
+    while stack:
+        node, i = stack[-1]
+        values = children(node)
+        if i < len(values):
+            stack[-1] = (node, i + 1)
+            stack.append((values[i], 0))
+        else:
+            stack.pop()
+            yield node
+
+
+class Visitor(Generic[R]):
+    """A bottom-up visitor: `visit` is called for each node once all its
+    operands have been visited, with the results for the operands. Results
+    are memoized per node, so shared subtrees are only visited once."""
+
+    def visit(self, node: Expression, values: tuple[R, ...]) -> R:
+        raise NotImplementedError
+
+    def __call__(self, root: Expression) -> R:
+        # NOTE: Results are indexed by `id()`, which is stable as all the
+        # nodes are kept alive by the root.
+        results: dict[int, R] = {}
+        stack: list[Expression] = [root]
+        while stack:
+            node = stack[-1]
+            if id(node) in results:
+                stack.pop()
+                continue
+            values = children(node)
+            pending = [_ for _ in values if id(_) not in results]
+            if pending:
+                stack.extend(reversed(pending))
+            else:
+                stack.pop()
+                results[id(node)] = self.visit(
+                    node, tuple(results[id(_)] for _ in values)
+                )
+        return results[id(root)]
+
+
+def expand(
+    produce: Callable[[Expression], Iterable[Union[str, R, Expression]]],
+    root: Expression,
+) -> Iterator[Union[str, R]]:
+    """Expands the atoms produced for the `root` node, where any value
+    or application atom is replaced by the atoms produced for it. This
+    is how backends handlers emit their operands."""
+    stack: list[Iterator] = [iter(produce(root))]
+    while stack:
+        for atom in stack[-1]:
+            if isinstance(atom, Expression):
+                stack.append(iter(produce(atom)))
+                break
+            else:
+                yield atom
+        else:
+            stack.pop()
+
+
+# EOF
@@ -0,0 +1,159 @@
+from .model import Type, Operation, Expression, Application
+from .backends import Backend
+from .backends.walk import postorder
+from .utils.dag import DAGGraphAdapter
+from typing import Iterable, Optional, Union
+
+# --
+# ## Incremental build
+#
+# A build is a set of named units, each a tree emitted by a backend. The
+# build records in a DAG how units depend on types and operations (and how
+# types depend on their parents and parameters), so that after a change
+# only the units downstream of the change are emitted again.
+
+TDependency = Union[Type, Operation, "Unit"]
+
+
+class Unit:
+    """A named tree to be emitted with a given backend. The output is kept
+    until the unit is invalidated."""
+
+    __slots__ = ("name", "value", "backend", "output")
+
+    def __init__(self, name: str, value: Expression, backend: Backend):
+        self.name = name
+        self.value = value
+        self.backend = backend
+        self.output: Optional[str] = None
+
+    @property
+    def isDirty(self) -> bool:
+        return self.output is None
+
+    def emit(self) -> str:
+        self.output = str(self.backend(self.value))
+        return self.output
+
+    def __repr__(self):
+        return f"(Unit {self.name}{' dirty' if self.isDirty else ''})"
+
+
+class Build:
+    """Keeps track of the dependencies between types, operations and
+    units, re-emitting only the units that depend on what changed."""
+
+    def __init__(self):
+        self.graph: DAGGraphAdapter = DAGGraphAdapter()
+        self.units: dict[str, Unit] = {}
+        # Keys of the types whose parents and parameters are registered
+        self.types: set[str] = set()
+
+    @staticmethod
+    def Key(item: TDependency) -> str:
+        """Returns the graph node name for the given dependency."""
+        if isinstance(item, Type):
+            return f"type:{item.key}"
+        elif isinstance(item, Operation):
+            return f"operation:{item.key}"
+        elif isinstance(item, Unit):
+            return f"unit:{item.name}"
+        else:
+            raise ValueError(f"Unsupported dependency: {item}")
+
+    def add(self, name: str, value: Expression, backend: Backend) -> Unit:
+        """Adds (or replaces) the unit of the given name, recording its
+        dependencies. A replaced unit keeps its dependencies on other
+        units (see `depend`), and the units depending on it are
+        invalidated."""
+        replaced = name in self.units
+        unit = self.units[name] = Unit(name, value, backend)
+        node = Build.Key(unit)
+        dag = self.graph.dag
+        units = [_ for _ in dag.inputs.get(node, ()) if _.startswith("unit:")]
+        dag.setNode(node, unit)
+        dag.clearInputs(node)
+        dag.addInputs(node, (*self.dependencies(value), *units))
+        if replaced:
+            self.invalidate(node)
+        return unit
+
+    def depend(self, name: str, *names: str) -> Unit:
+        """Makes the unit of the given name depend on the other units, so
+        that it is invalidated with them and emitted after them."""
+        node = Build.Key(self.units[name])
+        for _ in names:
+            self.ensureInput(node, Build.Key(self.units[_]))
+        return self.units[name]
+
+    def dependencies(self, value: Expression) -> Iterable[str]:
+        """Returns the graph nodes that the given tree depends on,
+        registering the types and operations it references."""
+        res: set[str] = set()
+        for node in postorder(value):
+            if node.type and (key := Build.Key(node.type)) not in res:
+                res.add(key)
+                self.type(node.type)
+            if isinstance(node, Application):
+                operands = node.values
+                ltype = operands[0].type if operands else None
+                rtype = operands[1].type if len(operands) > 1 else None
+                if ltype:
+                    key = f"operation:{Operation.Key(node.name, ltype, rtype)}"
+                    if key not in res:
+                        res.add(key)
+                        self.graph.node(key)
+                        # The operation depends on its operand types
+                        for _ in (ltype, rtype) if rtype else (ltype,):
+                            self.ensureInput(key, Build.Key(_))
+        return res
+
+    def type(self, type: Type) -> str:
+        """Registers the given type, its ancestors and parameters in
+        the graph."""
+        pending = [type]
+        while pending:
+            current = pending.pop()
+            key = Build.Key(current)
+            if key in self.types:
+                continue
+            self.types.add(key)
+            self.graph.node(key, current)
+            parents = [
+                Type.Registry.getNode(_) for _ in Type.Registry.inputs[current.id]
+            ]
+            for parent in (*parents, *current.parameters.values()):
+                pending.append(parent)
+                self.graph.node(Build.Key(parent), parent)
+                self.ensureInput(key, Build.Key(parent))
+        return Build.Key(type)
+
+    def ensureInput(self, node: str, input: str):
+        if input not in self.graph.dag.inputs.get(node, ()):
+            self.graph.dag.addInput(node, input)
+        return self
+
+    def invalidate(self, *items: Union[TDependency, str]) -> list[Unit]:
+        """Marks the units depending on the given types, operations or units
+        (or graph node names) as dirty, returning them."""
+        res: list[Unit] = []
+        for item in items:
+            key = item if isinstance(item, str) else Build.Key(item)
+            for node in (key, *self.graph.dag.descendants(key)):
+                unit = self.graph.dag.getNode(node)
+                if isinstance(unit, Unit) and not unit.isDirty:
+                    unit.output = None
+                    res.append(unit)
+        return res
+
+    def update(self) -> dict[str, str]:
+        """Emits the dirty units, returning their outputs by name."""
+        return {name: unit.emit() for name, unit in self.units.items() if unit.isDirty}
+
+    def outputs(self) -> dict[str, str]:
+        """Returns the output of all units, emitting the dirty ones."""
+        self.update()
+        return {name: unit.output for name, unit in self.units.items()}
+
+
+# EOF
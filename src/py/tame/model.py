@@ -1,7 +1,9 @@
 from .utils.dag import DAG
-from .utils.id import IntegerID
+from .universe import Universe, Universal
 from typing import TypeVar, Generic, Optional, Iterator, Iterable, Union
 from enum import Enum, Flag, auto
+from weakref import WeakValueDictionary
+import struct
 
 T = TypeVar("T")
 
@@ -52,7 +54,7 @@ class Operator(Enum):
     Eq = ":eq"
     Is = ":is"
     Gt = ":gt"
-    Lt = ":gt"
+    Lt = ":lt"
     And = ":and"
     Index = ":index"
     Access = ":access"
@@ -61,24 +63,98 @@ class Operator(Enum):
     Cond = ":cond"
 
 
-# TODO: The structure should create some kind of hash that is then
-# easily comparable with others.
-class Structure:
+class Interned:
+    """Base for model nodes that can be hash-consed. When interning is
+    enabled with `Interned.Enable()`, constructing a node whose structural
+    key (as returned by the class' `Key` static method, with the
+    constructor's arguments) matches a live node returns that node instead
+    of a new one. Nodes are then shared, and equal subtrees are
+    identical (`is`)."""
+
+    __slots__ = ("__weakref__",)
+
+    Enabled: bool = False
+    Table: WeakValueDictionary = WeakValueDictionary()
+
+    @staticmethod
+    def Enable(enabled: bool = True):
+        # NOTE: The interning `__new__` is only installed when first enabled,
+        # so that node construction doesn't pay for it otherwise. Once set,
+        # `__new__` can't be removed, only replaced.
+        if enabled or Interned.Enabled:
+            Interned.__new__ = staticmethod(
+                Interned.Intern if enabled else Interned.Create
+            )
+        Interned.Enabled = enabled
+
+    @staticmethod
+    def Key(*args, **kwargs) -> Optional[tuple]:
+        """Returns the structural key of the node that would be built with
+        the given arguments, or `None` if the node can't be interned."""
+        return None
+
+    @staticmethod
+    def Create(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    @staticmethod
+    def Intern(cls, *args, **kwargs):
+        # NOTE: Unpickling creates instances without arguments
+        if not (args or kwargs):
+            return object.__new__(cls)
+        key = cls.Key(*args, **kwargs)
+        if key is not None:
+            try:
+                node = Interned.Table.get(key)
+            except TypeError:
+                # Unhashable values (eg. a list literal) are not interned
+                return object.__new__(cls)
+            if node is None:
+                node = object.__new__(cls)
+                Interned.Table[key] = node
+            return node
+        return object.__new__(cls)
+
+
+class Structure(Interned):
+    """Describes the memory layout of a value. Structures are compared and
+    hashed by their `key`."""
+
+    __slots__ = ("size", "key")
+
+    @staticmethod
+    def Key(size: int) -> tuple:
+        return (Structure, size)
+
     def __init__(self, size: int):
         assert size % 8 == 0, f"Expected size multiple of 8, got: {size}"
         self.size: int = size
+        self.key: tuple = (Structure, size)
+
+    def __eq__(self, other: object) -> bool:
+        return self is other or (isinstance(other, Structure) and self.key == other.key)
+
+    def __hash__(self) -> int:
+        return hash(self.key)
 
     def __repr__(self):
         return f"#{self.size}"
 
 
 class Sequence(Structure):
+    __slots__ = ("itemSize", "length")
+
+    @staticmethod
+    def Key(size: int, length: int) -> tuple:
+        return (Sequence, size, length)
+
     def __init__(self, size: int, length: int):
         super().__init__(size * length)
         assert size % 8 == 0, f"Expected size multiple of 8, got: {size}"
         assert length > 0, f"Expected length to be > 0, got: {length}"
         self.itemSize = size
         self.length = length
+        self.key = (Sequence, size, length)
 
     def __repr__(self):
         return f"#[{self.length}*{self.itemSize}]={self.size}"
@@ -92,8 +168,22 @@ class Type:
     """A generic class to represent a variety of types, from basic name
     types to type parameters."""
 
-    Registry: DAG[int, "Type"] = DAG()
-    Symbols: dict[str, "Type"] = {}
+    __slots__ = (
+        "id",
+        "name",
+        "scope",
+        "qname",
+        "parameters",
+        "capabilities",
+        "isAbstract",
+        "key",
+    )
+
+    # NOTE: Both are resolved in the current `Universe`
+    Registry: DAG[int, "Type"] = Universal("types")
+    Symbols: dict[str, "Type"] = Universal("symbols")
+    # Instances of generic types, by tuple of type and parameter ids
+    Instances: dict[tuple, "Type"] = Universal("instances")
 
     def __init__(
         self,
@@ -108,7 +198,8 @@ class Type:
         **parameters: Optional[Union["Type"]],
         # TODO: Types can have constraints, like structure, bounds, etc.
     ):
-        self.id: int = next(IntegerID)
+        universe = Universe.Get()
+        self.id: int = next(universe.ids)
         self.name: str = name
         self.scope: Optional[Type] = scope
         self.qname: str = f"{scope.name}.{name}" if scope else name
@@ -126,12 +217,44 @@ class Type:
                 if _.isAbstract:
                     self.isAbstract = True
                     break
+        # NOTE: The key is cached, as the parameters keys are, so that
+        # deriving a key doesn't recurse through nested generics.
+        self.key: str = self.derivedKey()
         # We register the type in the registry
-        Type.Symbols[self.key] = self
+        universe.types.setNode(self.id, self)
+        universe.symbols[self.key] = self
 
-    @property
-    def key(self) -> str:
-        return self.derivedKey()
+    @staticmethod
+    def Get(id: int) -> Optional["Type"]:
+        """Returns the registered type with the given id."""
+        return Type.Registry.getNode(id)
+
+    @staticmethod
+    def Resolve(id: int, key: str) -> "Type":
+        """Returns the registered type with the given id, which must have
+        the given key, raising a `ValueError` otherwise. This is how types
+        are unpickled."""
+        res = Type.Get(id)
+        if res is None or res.key != key:
+            raise ValueError(
+                f"Type {key} is not registered with id {id}, got: {res} (see parallel.Snapshot)"
+            )
+        return res
+
+    @staticmethod
+    def SetRegistry(registry: DAG[int, "Type"]) -> DAG[int, "Type"]:
+        """Replaces the type registry with the given (indexed) DAG, typically
+        an `ArrayDAG` for large type universes, carrying over the types
+        registered so far, in the current universe. Returns the previous
+        registry."""
+        assert registry.index, "Type registry must be an indexed DAG"
+        previous = Type.Registry
+        for node, value in previous.nodes.items():
+            registry.setNode(node, value)
+        for node in previous.nodes:
+            registry.addInputs(node, previous.inputs[node])
+        Universe.Get().types = registry
+        return previous
 
     def derivedKey(
         self, parameters: Optional[Union[list["Type"], dict[str, "Type"]]] = None
@@ -158,27 +281,28 @@ class Type:
                 return False
         return True
 
-    def isa(self, other: "Type"):
+    def isa(self, other: "Type") -> bool:
+        """Tells if this type is the given type or derives from it."""
         assert isinstance(other, Type), f"Expected type, got: {other}"
-        # TODO: Should look in the DAG for similarities
-        if other is self:
-            return True
-        else:
-            raise NotImplementedError
+        return other is self or Type.Registry.index.isa(self.id, other.id)
+
+    def lineage(self) -> Iterator["Type"]:
+        """Iterates on this type and then its ancestors, the closest first."""
+        yield self
+        for _ in Type.Registry.ancestors(self.id):
+            yield Type.Registry.getNode(_)
 
     def intersect(self, other: "Type") -> Optional["Type"]:
-        """Returns the first common ancestors of both tyes"""
+        """Returns the first common ancestors of both tyes, which may
+        be one of the types if it is a supertype of the other."""
         assert isinstance(other, Type), f"Expected type, got: {other}"
         if other is self:
             return self
         else:
-            # NOTE: This is a bit awkward, and should be probably be
-            # something that is very fast to compute. There is an opportunity
-            # for a numerical representation of all of that.
-            a = {k: i for i, k in enumerate(Type.Registry.ancestors(self.id))}
-            b = {k: i for i, k in enumerate(Type.Registry.ancestors(other.id))}
-            l = sorted([(k, i) for k, i in b.items() if k in a], key=lambda _: _[1])
-            return Type.Registry.get(l[0]) if l else None
+            # NOTE: The registry index keeps the ancestors of each type as a
+            # bitset, so this is a `&` and a scan of the common bits.
+            common = Type.Registry.index.common(self.id, other.id)
+            return None if common is None else Type.Registry.getNode(common)
 
     def __lshift__(self, other: "Type"):
         assert isinstance(other, Type), f"Expected type, got: {other}"
@@ -194,48 +318,119 @@ class Type:
                 parameters[k] = args[i]
             elif k in kwargs:
                 parameters[k] = kwargs[k]
-        key = self.derivedKey(parameters)
         # We return the type if it's already there. This ensures
         # unicity of type instances.
-        if key in self.Symbols:
-            return self.Symbols[key]
-        else:
-            derived = Type(name=self.name, scope=self.scope, **parameters)
-            derived.capabilities = self.capabilities
-            # The derived type is linked to this type
-            return derived << self
+        instance = (self.id, *(_.id if _ else None for _ in parameters.values()))
+        instances = Type.Instances
+        derived = instances.get(instance)
+        if derived is None:
+            key = self.derivedKey(parameters)
+            derived = self.Symbols.get(key)
+            if derived is None:
+                derived = Type(name=self.name, scope=self.scope, **parameters)
+                derived.capabilities = self.capabilities
+                # The derived type is linked to this type
+                derived << self
+            instances[instance] = derived
+        return derived
 
     def __getitem__(self, key: str) -> Optional["Type"]:
         return self.parameters[key]
 
+    def __reduce__(self):
+        # Types are unique, so they are pickled by reference to the
+        # registry (see `parallel.Snapshot` to copy the registry itself).
+        return (Type.Resolve, (self.id, self.key))
+
     def __repr__(self):
         return f":{self.key}"
 
 
-class Value:
-    def __init__(self, type: Type, structure: Structure):
+class Expression(Interned):
+    """Base for values and applications, which can both be operands of
+    applications."""
+
+    __slots__ = ()
+
+    def __add__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Add, self, other)
+
+    def __sub__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Sub, self, other)
+
+    def __mul__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Mul, self, other)
+
+    def __truediv__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Div, self, other)
+
+    def __mod__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Mod, self, other)
+
+    def __pow__(self, other: "Expression"):
+        assert isinstance(
+            other, Expression
+        ), f"Can only accept a Value or Application, got: {other}"
+        return Application(Operator.Pow, self, other)
+
+
+class Value(Expression):
+    """A value of a given type and structure. Values are opaque, so two
+    values are only the same if they are the same instance: they are never
+    merged by interning, unlike literals and applications. Values can be
+    given a name, which backends use to reference them."""
+
+    __slots__ = ("type", "structure", "name")
+
+    def __init__(self, type: Type, structure: Structure, name: Optional[str] = None):
         self.type = type
         self.structure = structure
+        self.name = name
 
     @property
     def size(self) -> Optional[int]:
         return self.structure.size
 
-    def __add__(self, other: "Value"):
+    def __getitem__(self, key: Expression):
         assert isinstance(
-            other, Value
-        ), "Can only accept a Value subclass, got: {other}"
-        return Application(Operator.Add, self, other)
-
-    def __getitem__(self, key: "Value"):
-        assert isinstance(key, Value), "Can only accept a Value subclass, got: {other}"
+            key, Expression
+        ), f"Can only accept a Value or Application, got: {key}"
         return Application(Operator.Index, self, key)
 
     def __repr__(self):
-        return f"({self.__class__.__name__}{self.type}{self.structure})"
+        return f"({self.__class__.__name__}{self.type}{self.structure}{f' {self.name}' if self.name else ''})"
 
 
 class Literal(Value, Generic[T]):
+    __slots__ = ("value",)
+
+    @staticmethod
+    def Key(type: Type, structure: Structure, value: T) -> tuple:
+        # NOTE: Floats are keyed by their bits, as `-0.0 == 0.0` but they
+        # are different literals.
+        return (
+            Literal,
+            type,
+            structure,
+            value.__class__,
+            struct.pack("<d", value) if value.__class__ is float else value,
+        )
+
     def __init__(self, type: Type, structure: Structure, value: T):
         super().__init__(type, structure)
         self.value = value
@@ -245,11 +440,13 @@ class Literal(Value, Generic[T]):
 
 
 class Operation:
-    Registry: dict[str, "Operation"] = {}
+    __slots__ = ("name", "lvalue", "rvalue", "type", "key")
+
+    Registry: dict[str, "Operation"] = Universal("operations")
 
     @staticmethod
     def Key(name: Union[Operator, str], lvalue: Type, rvalue: Optional[Type]):
-        return "{name.value if isinstance(name,Operator) else name}.{lvalue.key}{f'.{rvalue.key}' if rvalue else ''}"
+        return f"{name.value if isinstance(name,Operator) else name}.{lvalue.key}{f'.{rvalue.key}' if rvalue else ''}"
 
     @staticmethod
     def Ensure(name: Union[Operator, str], lvalue: Type, rvalue: Optional[Type]):
@@ -269,25 +466,113 @@ class Operation:
         self.type: Optional[Type] = (
             lvalue if rvalue is None else lvalue.intersect(rvalue)
         )
-        self.key = "{name.value if isinstance(name,Operator) else name}.{lvalue.key}{f'.{rvalue.key}' if rvalue else ''}"
+        self.key = Operation.Key(name, lvalue, rvalue)
+        # NOTE: Registering with `setdefault` is not a lookup, so that it
+        # isn't counted as a miss by profiles (see `Lookups`).
+        registered = Operation.Registry.setdefault(self.key, self)
         assert (
-            self.key not in Operation.Registry
+            registered is self
         ), "Operation already registered, use 'Operation.Ensure()' instead"
-        Operation.Registry[self.key] = self
 
     def __repr__(self):
         return f"({self.name} {self.lvalue} {self.rvalue})"
 
 
-class Application:
+class Application(Expression):
     """Represents the application of values to a symbol/operator. The actual
     operation represented by the symbol/operator will be resolved by the
-    runtime."""
+    runtime.
+
+    Applications of operators to sequences are element-wise: the result is
+    a sequence of the same length, where scalar operands are applied to
+    every element."""
+
+    __slots__ = ("name", "values", "arity", "type", "structure")
+
+    # Operators whose result is a truth value, typed as a natural number
+    Predicates: frozenset = frozenset(
+        (
+            Operator.Not,
+            Operator.Or,
+            Operator.And,
+            Operator.Eq,
+            Operator.Is,
+            Operator.Gt,
+            Operator.Lt,
+        )
+    )
+
+    @staticmethod
+    def Key(name: Union[Operator, str], *value: Expression) -> tuple:
+        # NOTE: Interned arguments are canonical, so they are compared
+        # by identity, which keeps the key shallow.
+        return (Application, name, *value)
 
-    def __init__(self, name: Union[Operator, str], *value: Value):
+    @staticmethod
+    def Promote(ltype: Optional[Type], rtype: Optional[Type]) -> Optional[Type]:
+        """Returns the type of an application to operands of the given types,
+        which is their common type, unless one of them is a decimal number,
+        in which case, like in C, the result is a decimal number."""
+        if ltype is None or rtype is None or ltype is rtype:
+            return ltype
+        # NOTE: Standard types are defined in `api`, which imports this
+        # module.
+        from . import api
+
+        decimal = api.standard("DecimalNumber")
+        isDecimal = ltype.isa(decimal)
+        if isDecimal != rtype.isa(decimal):
+            return ltype if isDecimal else rtype
+        return ltype.intersect(rtype)
+
+    def __init__(self, name: Union[Operator, str], *value: Expression):
         self.name = name
         self.values = value
         self.arity = len(value)
+        # FIXME: This should be given by the operation the application
+        # resolves to, for now this is the promoted type of the operands, and
+        # their widest structure. The type and structure of a condition are
+        # those of its branches.
+        isCond = name is Operator.Cond and len(value) == 3
+        operands = value[1:] if isCond else value
+        ltype = operands[0].type if operands else None
+        rtype = operands[1].type if len(operands) > 1 else None
+        if name in Application.Predicates:
+            # NOTE: Standard types are defined in `api`, which imports
+            # this module.
+            from . import api
+
+            self.type: Optional[Type] = api.standard("NaturalNumber")
+        else:
+            self.type = Application.Promote(ltype, rtype)
+        self.structure: Optional[Structure] = None
+        sequence: Optional[Expression] = None
+        for i, _ in enumerate(value):
+            structure = _.structure
+            if isinstance(structure, Sequence):
+                if sequence is None:
+                    sequence = _
+                else:
+                    assert (
+                        structure.length == sequence.structure.length
+                    ), f"Sequences should have the same length, got: {sequence} and {_}"
+            elif (
+                structure
+                and not (isCond and i == 0)
+                and (self.structure is None or structure.size > self.structure.size)
+            ):
+                self.structure = structure
+        if sequence is None:
+            pass
+        elif name is Operator.Index and sequence is value[0]:
+            # Indexing a sequence gives one of its items, typed with the
+            # sequence type's parameter, if any.
+            self.structure = Structure(sequence.structure.itemSize)
+            parameters = list(ltype.parameters.values()) if ltype else []
+            self.type = parameters[0] if len(parameters) == 1 else ltype
+        else:
+            self.structure = sequence.structure
+            self.type = sequence.type if self.type is None else self.type
 
     def __getitem__(self, index: int):
         assert index >= 0 and index < self.arity
@@ -0,0 +1,183 @@
+from .model import (
+    Type,
+    Expression,
+    Value,
+    Literal,
+    Application,
+)
+from . import api
+from .backends import Backend
+from .backends.walk import Visitor
+from .build import Build, Unit
+from .universe import Universe
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# --
+# ## Parallel emission
+#
+# Emits the units of a build across a pool of worker processes. Workers
+# receive a snapshot of the type registry, so that types can be pickled by
+# id, and trees are shipped as flat node lists, so that pickling doesn't
+# recurse through deep trees.
+
+# A packed node: ("A", operator, operand indexes), ("L", type id, structure,
+# value) or ("V", type id, structure, name)
+TPacked = tuple
+
+
+class Snapshot:
+    """A picklable copy of the type registry, which is restored in worker
+    processes so that types keep their ids, along with the ids of the
+    standard types (see `api.adopt`)."""
+
+    def __init__(self):
+        self.types: list[tuple] = [
+            (
+                _.id,
+                _.name,
+                _.scope.id if _.scope else None,
+                {k: v.id for k, v in _.parameters.items()},
+                _.capabilities,
+                _.isAbstract,
+                list(Type.Registry.inputs[_.id]),
+            )
+            for _ in Type.Registry.nodes.values()
+            if _ is not None
+        ]
+        # NOTE: Only the materialized standard types are given, as the
+        # others can't be referenced by the snapshot's types.
+        self.standard: dict[str, int] = {
+            k: v.id for k in api.Standard if isinstance(v := vars(api).get(k), Type)
+        }
+
+    def restore(self):
+        """Registers the types of the snapshot that are missing from the
+        current registry. Types that are already registered with the same
+        name and parents (for instance in a forked worker) are kept as is,
+        others (for instance created by a spawned worker importing the main
+        module) are replaced."""
+        created: list[tuple[Type, tuple]] = []
+        for entry in self.types:
+            id, name = entry[0], entry[1]
+            existing = Type.Get(id)
+            if (
+                existing is None
+                or existing.name != name
+                or list(Type.Registry.inputs[id]) != entry[6]
+            ):
+                # We create the type without its constructor, which would
+                # allocate a new id.
+                t = object.__new__(Type)
+                t.id = id
+                t.name = name
+                Type.Registry.setNode(id, t)
+                created.append((t, entry))
+        for t, (_, name, scope, parameters, capabilities, isAbstract, _) in created:
+            t.scope = Type.Get(scope) if scope is not None else None
+            t.qname = f"{t.scope.name}.{name}" if t.scope else name
+            t.parameters = {k: Type.Get(v) for k, v in parameters.items()}
+            t.capabilities = capabilities
+            t.isAbstract = isAbstract
+            t.key = t.derivedKey()
+        for t, entry in created:
+            Type.Registry.setInputs(t.id, entry[6])
+            Type.Symbols[t.key] = t
+        if created:
+            # Replaced types must not be found by key or instance anymore
+            for table in (Type.Symbols, Type.Instances):
+                for k in [k for k, v in table.items() if Type.Get(v.id) is not v]:
+                    del table[k]
+        for name, id in self.standard.items():
+            api.adopt(name, Type.Get(id))
+        # New types must not reuse the ids of the snapshot
+        Universe.Get().ids.advance(max((_[0] for _ in self.types), default=-1) + 1)
+        return self
+
+
+class Pack(Visitor[int]):
+    """Packs a tree into a flat list of nodes, operands first."""
+
+    def __init__(self):
+        self.nodes: list[TPacked] = []
+
+    def visit(self, node: Expression, values: tuple[int, ...]) -> int:
+        if isinstance(node, Application):
+            self.nodes.append(("A", node.name, values))
+        elif isinstance(node, Literal):
+            self.nodes.append(("L", node.type.id, node.structure, node.value))
+        else:
+            self.nodes.append(("V", node.type.id, node.structure, node.name))
+        return len(self.nodes) - 1
+
+
+def pack(value: Expression) -> list[TPacked]:
+    packer = Pack()
+    packer(value)
+    return packer.nodes
+
+
+def unpack(nodes: list[TPacked]) -> Expression:
+    """Rebuilds the tree packed by `pack`."""
+    res: list[Expression] = []
+    for node in nodes:
+        if node[0] == "A":
+            res.append(Application(node[1], *(res[_] for _ in node[2])))
+        elif node[0] == "L":
+            res.append(Literal(Type.Get(node[1]), node[2], node[3]))
+        else:
+            res.append(Value(Type.Get(node[1]), node[2], node[3]))
+    return res[-1]
+
+
+def restore(snapshot: Snapshot):
+    snapshot.restore()
+
+
+def emitUnit(backend: Backend, nodes: list[TPacked]) -> str:
+    return str(backend(unpack(nodes)))
+
+
+def levels(build: Build) -> list[list[Unit]]:
+    """Groups the units of the build in levels, so that the units of a
+    level only depend on units of the previous levels."""
+    dag = build.graph.dag
+    # NOTE: Units are looked up by name in the build, which has the
+    # current unit when one is replaced.
+    units: dict[str, Unit] = {Build.Key(_): _ for _ in build.units.values()}
+    # The level of a node is the number of units on its longest path
+    # from a root, computed in rank (topological) order.
+    level: dict[str, int] = {}
+    res: list[list[Unit]] = []
+    for node in dag.ranks():
+        n = 0
+        for _ in dag.inputs[node]:
+            n = max(n, level[_] + (1 if _ in units else 0))
+        level[node] = n
+        unit = units.get(node)
+        if unit:
+            while len(res) <= n:
+                res.append([])
+            res[n].append(unit)
+    return res
+
+
+def emit(build: Build, workers: Optional[int] = None) -> str:
+    """Emits the dirty units of the build across a pool of `workers`
+    processes, level by level, and returns the output of all the units,
+    in the order they were added to the build."""
+    dirty = [[_ for _ in units if _.isDirty] for units in levels(build)]
+    if any(dirty):
+        with ProcessPoolExecutor(
+            workers, initializer=restore, initargs=(Snapshot(),)
+        ) as pool:
+            for units in dirty:
+                futures = [
+                    pool.submit(emitUnit, _.backend, pack(_.value)) for _ in units
+                ]
+                for unit, future in zip(units, futures):
+                    unit.output = future.result()
+    return "\n".join(_.output for _ in build.units.values())
+
+
+# EOF
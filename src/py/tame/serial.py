@@ -0,0 +1,414 @@
+from .model import (
+    Type,
+    Expression,
+    Value,
+    Literal,
+    Application,
+    Structure,
+    Sequence,
+    Operation,
+    Operator,
+)
+from . import api
+from .backends.walk import Visitor
+from .universe import Universe
+from array import array
+from mmap import mmap, ACCESS_READ
+from typing import Iterable, Optional, Union
+import struct
+import sys
+
+# --
+# ## Binary models
+#
+# Persists type registries, operations and expression trees in a versioned
+# binary format that can be loaded without re-executing the definition
+# code. A model is a header followed by sections, each an array of
+# little-endian int64, except for the string blob:
+#
+# - `Strings`: offsets (count + 1) of the UTF-8 strings in the blob
+# - `Types`: records of `TYPE_FIELDS` (string and type indexes, -1 for none)
+# - `Parameters`: (key string, type) pairs, referenced by the types
+# - `Inputs`: parent type indexes, referenced by the types
+# - `Operations`: records of `OPERATION_FIELDS`
+# - `Expressions`: records of `EXPRESSION_FIELDS`, operands first
+# - `Operands`: expression indexes, referenced by the applications
+# - `Roots`: the indexes of the dumped expressions
+#
+# The header is the magic, the version and the (offset, size) in bytes of
+# each section, which are 8-byte aligned so they can be cast in place from
+# a `memoryview` of an `mmap`.
+
+MAGIC = b"TAME"
+VERSION = 1
+SECTIONS = (
+    "Offsets",
+    "Strings",
+    "Types",
+    "Parameters",
+    "Inputs",
+    "Operations",
+    "Expressions",
+    "Operands",
+    "Roots",
+)
+HEADER = struct.Struct(f"<4sI{2 * len(SECTIONS)}Q")
+
+# name, qname, key, scope, capabilities, isAbstract, parameters start,
+# parameters count, inputs start, inputs count
+TYPE_FIELDS = 10
+# name, isOperator, lvalue, rvalue
+OPERATION_FIELDS = 4
+# kind, type, size, length, name/value, isOperator, operands start,
+# operands count
+EXPRESSION_FIELDS = 8
+
+KIND_VALUE = 0
+KIND_INTEGER = 1
+KIND_FLOAT = 2
+KIND_APPLICATION = 3
+
+TBuffer = Union[bytes, bytearray, memoryview, mmap]
+
+
+class Strings:
+    """A string table, where each distinct string has an index."""
+
+    def __init__(self):
+        self.indexes: dict[str, int] = {}
+        self.values: list[str] = []
+
+    def __call__(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+class Encoder(Visitor[int]):
+    """Encodes expression trees as records, operands first. Shared
+    subtrees are encoded once."""
+
+    def __init__(self, strings: Strings, types: dict[int, int]):
+        self.strings = strings
+        self.types = types
+        self.expressions = array("q")
+        self.operands = array("q")
+        # NOTE: Values are only the same if they are the same instance, so
+        # we keep their index across the encoded trees.
+        self.values: dict[int, tuple[int, Value]] = {}
+        self.count: int = 0
+
+    def visit(self, node: Expression, values: tuple[int, ...]) -> int:
+        if type(node) is Value and id(node) in self.values:
+            return self.values[id(node)][0]
+        elif isinstance(node, Application):
+            isOperator = isinstance(node.name, Operator)
+            record = (
+                KIND_APPLICATION,
+                -1,
+                0,
+                -1,
+                self.strings(node.name.value if isOperator else node.name),
+                1 if isOperator else 0,
+                len(self.operands),
+                len(values),
+            )
+            self.operands.extend(values)
+        else:
+            structure = node.structure
+            length = structure.length if isinstance(structure, Sequence) else -1
+            size = structure.itemSize if length >= 0 else structure.size
+            if isinstance(node, Literal):
+                # NOTE: `bool` is an `int`, but it wouldn't round-trip
+                if type(node.value) is int:
+                    kind, value = KIND_INTEGER, node.value
+                elif type(node.value) is float:
+                    kind = KIND_FLOAT
+                    value = struct.unpack("<q", struct.pack("<d", node.value))[0]
+                else:
+                    raise ValueError(f"Unsupported literal value: {node.value!r}")
+            else:
+                kind, value = KIND_VALUE, self.strings(node.name)
+            record = (kind, self.types[node.type.id], size, length, value, 0, 0, 0)
+        self.expressions.extend(record)
+        self.count += 1
+        if type(node) is Value:
+            self.values[id(node)] = (self.count - 1, node)
+        return self.count - 1
+
+
+def dump(
+    expressions: Iterable[Expression] = (),
+    operations: Optional[Iterable[Operation]] = None,
+) -> bytes:
+    """Dumps the types of the current universe, the given operations
+    (all the registered ones by default) and the given expressions."""
+    strings = Strings()
+    types = [_ for _ in Type.Registry.nodes.values() if _ is not None]
+    indexes: dict[int, int] = {t.id: i for i, t in enumerate(types)}
+    records = array("q")
+    parameters = array("q")
+    inputs = array("q")
+    for t in types:
+        parents = [indexes[_] for _ in Type.Registry.inputs[t.id] if _ in indexes]
+        records.extend(
+            (
+                strings(t.name),
+                strings(t.qname),
+                strings(t.key),
+                indexes[t.scope.id] if t.scope else -1,
+                t.capabilities,
+                1 if t.isAbstract else 0,
+                len(parameters) // 2,
+                len(t.parameters),
+                len(inputs),
+                len(parents),
+            )
+        )
+        for k, v in t.parameters.items():
+            parameters.extend((strings(k), indexes[v.id] if v else -1))
+        inputs.extend(parents)
+    ops = array("q")
+    for op in Operation.Registry.values() if operations is None else operations:
+        isOperator = isinstance(op.name, Operator)
+        ops.extend(
+            (
+                strings(op.name.value if isOperator else op.name),
+                1 if isOperator else 0,
+                indexes[op.lvalue.id],
+                indexes[op.rvalue.id] if op.rvalue else -1,
+            )
+        )
+    encoder = Encoder(strings, indexes)
+    roots = array("q", (encoder(_) for _ in expressions))
+    # The string table is built last, as encoding adds strings
+    blob = bytearray()
+    offsets = array("q", [0])
+    for _ in strings.values:
+        blob += _.encode("utf8")
+        offsets.append(len(blob))
+    sections = [
+        offsets,
+        bytes(blob),
+        records,
+        parameters,
+        inputs,
+        ops,
+        encoder.expressions,
+        encoder.operands,
+        roots,
+    ]
+    if sys.byteorder != "little":
+        for _ in sections:
+            if isinstance(_, array):
+                _.byteswap()
+    layout: list[int] = []
+    body = bytearray()
+    for _ in sections:
+        data = _.tobytes() if isinstance(_, array) else _
+        layout += (HEADER.size + len(body), len(data))
+        body += data
+        body += b"\0" * (-len(body) % 8)
+    return HEADER.pack(MAGIC, VERSION, *layout) + bytes(body)
+
+
+def write(path: str, *args, **kwargs) -> int:
+    """Dumps the model (see `dump`) to the given path."""
+    data = dump(*args, **kwargs)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+class Model:
+    """A loaded model, with the types, operations and expressions mapped
+    to the ones of the current universe."""
+
+    def __init__(self, buffer: TBuffer):
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise ValueError("Truncated model header")
+        magic, version, *layout = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"Not a model, magic is: {magic!r}")
+        if version != VERSION:
+            raise ValueError(f"Unsupported model version {version}, expected {VERSION}")
+        self.view = view
+        self.sections: dict[str, memoryview] = {}
+        for i, name in enumerate(SECTIONS):
+            offset, size = layout[2 * i], layout[2 * i + 1]
+            if offset + size > len(view):
+                raise ValueError(f"Truncated model section: {name}")
+            data = view[offset : offset + size]
+            self.sections[name] = data if name == "Strings" else self.ints(data)
+        self.strings: list[Optional[str]] = [None] * (len(self.sections["Offsets"]) - 1)
+        self.types: list[Type] = []
+        self.operations: list[Operation] = []
+        self.expressions: list[Expression] = []
+
+    @staticmethod
+    def ints(data: memoryview) -> Union[memoryview, array]:
+        # NOTE: This is zero-copy on little-endian hosts
+        if sys.byteorder == "little":
+            return data.cast("q")
+        else:
+            res = array("q", data.tobytes())
+            res.byteswap()
+            return res
+
+    def string(self, index: int) -> Optional[str]:
+        if index < 0:
+            return None
+        res = self.strings[index]
+        if res is None:
+            offsets = self.sections["Offsets"]
+            res = self.strings[index] = str(
+                self.sections["Strings"][offsets[index] : offsets[index + 1]],
+                "utf8",
+            )
+        return res
+
+    def loadTypes(self) -> list[Type]:
+        """Maps the types of the model to the types of the current
+        universe, creating the ones that are not registered yet. Standard
+        types are mapped to the ones of `api`, so that backends recognize
+        them in any universe."""
+        records = self.sections["Types"].tolist()
+        count = len(records) // TYPE_FIELDS
+        universe = Universe.Get()
+        api.materialize()
+        standard: dict[str, Type] = {
+            _.key: _
+            for _ in (api.standard(name) for name in api.Standard)
+            if isinstance(_, Type)
+        }
+        created: list[tuple[Type, int]] = []
+        registered: list[tuple[Type, int]] = []
+        types: list[Type] = []
+        for i in range(count):
+            o = i * TYPE_FIELDS
+            key = self.string(records[o + 2])
+            t = universe.symbols.get(key)
+            if t is None and key in standard:
+                # The standard type is registered in this universe as is
+                t = standard[key]
+                registered.append((t, o))
+            elif t is None:
+                # We create the type without its constructor, as its
+                # parameters and scope may not be created yet.
+                t = object.__new__(Type)
+                t.id = next(universe.ids)
+                t.name = self.string(records[o])
+                t.qname = self.string(records[o + 1])
+                t.key = key
+                t.capabilities = records[o + 4]
+                t.isAbstract = bool(records[o + 5])
+                created.append((t, o))
+            types.append(t)
+        parameters = self.sections["Parameters"].tolist()
+        inputs = self.sections["Inputs"]
+        for t, o in created:
+            scope = records[o + 3]
+            t.scope = types[scope] if scope >= 0 else None
+            start = records[o + 6] * 2
+            t.parameters = {
+                self.string(parameters[j]): (
+                    types[parameters[j + 1]] if parameters[j + 1] >= 0 else None
+                )
+                for j in range(start, start + records[o + 7] * 2, 2)
+            }
+        for t, o in (*registered, *created):
+            universe.types.setNode(t.id, t)
+            universe.symbols[t.key] = t
+        for t, o in (*registered, *created):
+            start = records[o + 8]
+            universe.types.addInputs(
+                t.id, [types[_].id for _ in inputs[start : start + records[o + 9]]]
+            )
+        self.types = types
+        return types
+
+    def loadOperations(self) -> list[Operation]:
+        records = self.sections["Operations"]
+        types = self.types
+        self.operations = [
+            Operation.Ensure(
+                self.name(records[o], records[o + 1]),
+                types[records[o + 2]],
+                types[records[o + 3]] if records[o + 3] >= 0 else None,
+            )
+            for o in range(0, len(records), OPERATION_FIELDS)
+        ]
+        return self.operations
+
+    def loadExpressions(self) -> list[Expression]:
+        records = self.sections["Expressions"].tolist()
+        operands = self.sections["Operands"]
+        types = self.types
+        nodes: list[Expression] = []
+        for o in range(0, len(records), EXPRESSION_FIELDS):
+            kind = records[o]
+            if kind == KIND_APPLICATION:
+                start = records[o + 6]
+                nodes.append(
+                    Application(
+                        self.name(records[o + 4], records[o + 5]),
+                        *(nodes[_] for _ in operands[start : start + records[o + 7]]),
+                    )
+                )
+            else:
+                size, length = records[o + 2], records[o + 3]
+                structure = Sequence(size, length) if length >= 0 else Structure(size)
+                value = records[o + 4]
+                if kind == KIND_VALUE:
+                    nodes.append(
+                        Value(types[records[o + 1]], structure, self.string(value))
+                    )
+                else:
+                    if kind == KIND_FLOAT:
+                        value = struct.unpack("<d", struct.pack("<q", value))[0]
+                    nodes.append(Literal(types[records[o + 1]], structure, value))
+        self.expressions = [nodes[_] for _ in self.sections["Roots"]]
+        return self.expressions
+
+    def release(self):
+        """Releases the views on the buffer, which is required before
+        closing an `mmap`."""
+        for _ in self.sections.values():
+            if isinstance(_, memoryview):
+                _.release()
+        self.sections.clear()
+        self.view.release()
+        return self
+
+    def name(self, index: int, isOperator: int) -> Union[Operator, str]:
+        name = self.string(index)
+        return Operator(name) if isOperator else name
+
+    def load(self) -> "Model":
+        self.loadTypes()
+        self.loadOperations()
+        self.loadExpressions()
+        return self
+
+
+def load(buffer: TBuffer) -> Model:
+    """Loads the model from the given buffer, in the current universe."""
+    return Model(buffer).load()
+
+
+def read(path: str) -> Model:
+    """Loads the model at the given path, which is memory-mapped."""
+    with open(path, "rb") as f:
+        data = mmap(f.fileno(), 0, access=ACCESS_READ)
+    try:
+        return Model(data).load().release()
+    finally:
+        data.close()
+
+
+# EOF
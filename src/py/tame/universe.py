@@ -0,0 +1,94 @@
+from .utils.dag import DAG
+from .utils.id import Counter, IntegerID
+from contextvars import ContextVar, Token
+from typing import Optional, Any
+
+# --
+# ## Universe
+#
+# A universe owns the type registry, the symbol table, the operation table
+# and the id allocator. The current universe is held in a context variable,
+# so that threads and tasks can model different programs concurrently, and
+# a whole universe can be discarded at once.
+
+
+class Universe:
+    __slots__ = ("types", "symbols", "instances", "operations", "ids")
+
+    Default: "Universe"
+    Current: ContextVar["Universe"]
+    # The tokens to restore the previous universes, as an immutable stack
+    # so that it can be shared by copied contexts.
+    Stack: ContextVar[Optional[tuple[Token, Any]]]
+
+    @staticmethod
+    def Get() -> "Universe":
+        """Returns the current universe."""
+        return Universe.Current.get()
+
+    def __init__(
+        self, base: Optional["Universe"] = None, ids: Optional[Counter] = None
+    ):
+        """Creates a universe, which is empty unless a `base` universe is
+        given, in which case its types and operations are copied (pass
+        `Universe.Default` to start from the standard types). Ids are
+        allocated from the base's counter (or the global one), so that
+        they stay unique across universes."""
+        self.types: DAG = DAG(indexed=True)
+        self.symbols: dict[str, Any] = {}
+        self.instances: dict[tuple, Any] = {}
+        self.operations: dict[str, Any] = {}
+        self.ids: Counter = ids or (base.ids if base else IntegerID)
+        if base is not None and base is Universe.Default:
+            # NOTE: Standard types are created lazily in the default
+            # universe, so they need to exist before it is copied.
+            from . import api
+
+            api.materialize()
+        if base:
+            for node, value in base.types.nodes.items():
+                self.types.setNode(node, value)
+            for node in base.types.nodes:
+                self.types.addInputs(node, base.types.inputs[node])
+            self.symbols.update(base.symbols)
+            self.instances.update(base.instances)
+            self.operations.update(base.operations)
+
+    def discard(self):
+        """Drops all the types and operations of this universe."""
+        self.types.reset()
+        self.symbols.clear()
+        self.instances.clear()
+        self.operations.clear()
+        return self
+
+    def __enter__(self):
+        Universe.Stack.set((Universe.Current.set(self), Universe.Stack.get()))
+        return self
+
+    def __exit__(self, *args):
+        token, previous = Universe.Stack.get()
+        Universe.Stack.set(previous)
+        Universe.Current.reset(token)
+
+
+class Universal:
+    """A class attribute that resolves to the given field of the current
+    universe, like `Type.Registry`."""
+
+    __slots__ = ("field",)
+
+    def __init__(self, field: str):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        return getattr(Universe.Current.get(), self.field)
+
+
+# NOTE: The default universe uses the global id allocator, which derived
+# universes share, so that ids stay unique across universes.
+Universe.Default = Universe(ids=IntegerID)
+Universe.Current = ContextVar("Universe", default=Universe.Default)
+Universe.Stack = ContextVar("UniverseStack", default=None)
+
+# EOF
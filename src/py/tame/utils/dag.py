@@ -1,4 +1,6 @@
-from typing import Generic, TypeVar, Iterable, Optional, Union
+from array import array
+from collections.abc import Callable, Mapping
+from typing import Any, Generic, TypeVar, Iterable, Iterator, Optional, Union, TextIO
 from weakref import WeakValueDictionary
 
 K = TypeVar("K")
@@ -79,23 +81,210 @@ class DAGGraphAdapter(Generic[T]):
             self.dag.setNode(name, value)
         return self.nodes[name]
 
+    def link(self, edges: Iterable[tuple[str, str]]):
+        """Links the named nodes in bulk, where each `(source, target)` pair
+        is like `source & target`, see `DAG.addEdges`."""
+        self.dag.addEdges((target, source) for source, target in edges)
+        return self
+
     def __str__(self) -> str:
         return toASCII(self.dag)
 
 
+class DAGIndex(Generic[K]):
+    """Maintains the ancestor closure of each node of a DAG as an integer
+    bitset, where each node that is the input of another is given a bit.
+    Testing if a node is an ancestor of another is then a single bit test,
+    and the common ancestors of two nodes are a single `&`. The index is
+    updated incrementally as edges are added and removed.
+
+    Bitsets are as wide as the highest bit of the ancestors, so the index
+    suits registry-like graphs, where nodes have few ancestors, but takes
+    quadratic memory on deep and narrow graphs like long chains."""
+
+    def __init__(self, dag: "DAG[K, Any]"):
+        self.dag = dag
+        # Bit position of each node, and node at each bit position. Only
+        # nodes with outputs get a bit, so that the bitsets stay as small
+        # as the number of parent nodes, not the number of nodes.
+        self.bits: dict[K, int] = {}
+        self.keys: list[K] = []
+        # Ancestors of each node (including itself if it has a bit) as a
+        # bitset, omitted when empty
+        self.closure: dict[K, int] = {}
+        # Length of the longest path from a root to the node, omitted when 0
+        self.depth: dict[K, int] = {}
+        # Memoized results for `common`, cleared on any change
+        self.cache: dict[tuple[K, K], Optional[K]] = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """Recomputes the whole index from the DAG."""
+        self.bits = {}
+        self.keys = []
+        self.closure = {}
+        self.depth = {}
+        self.cache = {}
+        for node in self.dag.nodes:
+            for parent in self.dag.inputs.get(node, ()):
+                self.addEdge(node, parent)
+        return self
+
+    def addNode(self, node: K):
+        # NOTE: Nodes are implicitly part of the index, they only take
+        # space once they have ancestors or descendants.
+        return self
+
+    def addEdge(self, node: K, inputNode: K):
+        """Updates the index so that `inputNode` and its ancestors are
+        ancestors of `node` and all its descendants."""
+        closure = self.closure
+        depth = self.depth
+        self.allocate(inputNode)
+        self.cache.clear()
+        closure[node] = closure.get(node, 0) | closure[inputNode]
+        depth[node] = max(depth.get(node, 0), depth.get(inputNode, 0) + 1)
+        # We only walk the descendants that actually change, which is
+        # usually none as types are derived after their parents.
+        pending = [node]
+        while pending:
+            parent = pending.pop()
+            for child in self.dag.outputs.get(parent, ()):
+                c = closure.get(child, 0) | closure[parent]
+                d = max(depth.get(child, 0), depth[parent] + 1)
+                if c != closure.get(child) or d != depth.get(child):
+                    closure[child] = c
+                    depth[child] = d
+                    pending.append(child)
+        return self
+
+    def allocate(self, node: K) -> int:
+        """Ensures the node has a bit, which it needs once it has outputs."""
+        bit = self.bits.get(node)
+        if bit is None:
+            bit = self.bits[node] = len(self.keys)
+            self.keys.append(node)
+            self.closure[node] = self.closure.get(node, 0) | (1 << bit)
+        return bit
+
+    def update(self, *nodes: K, order: Optional[Iterable[K]] = None):
+        """Recomputes the index for the given nodes and their descendants,
+        which is needed when inputs are removed, as bitsets can't be
+        decremented, and cheaper than adding edges one by one in bulk.
+        Nodes are updated in topological order, which is given as `order`
+        when already known (eg. from `DAG.ranks`)."""
+        dag = self.dag
+        bits, closure, depth = self.bits, self.closure, self.depth
+        self.cache.clear()
+        # We collect the nodes and their descendants, breadth-first
+        inside: set[K] = set(nodes)
+        affected: list[K] = list(inside)
+        i = 0
+        while i < len(affected):
+            for _ in dag.outputs[affected[i]]:
+                if _ not in inside:
+                    inside.add(_)
+                    affected.append(_)
+            i += 1
+        pending: dict[K, int] = (
+            {n: sum(1 for _ in dag.inputs[n] if _ in inside) for n in affected}
+            if order is None
+            else {}
+        )
+        ready: list[K] = (
+            [n for n in affected if not pending[n]]
+            if order is None
+            else [n for n in order if n in inside]
+        )
+        i = 0
+        while i < len(ready):
+            current = ready[i]
+            i += 1
+            c = 1 << bits[current] if current in bits else 0
+            d = 0
+            for parent in dag.inputs[current]:
+                c |= closure.get(parent, 0)
+                d = max(d, depth.get(parent, 0) + 1)
+            if c:
+                closure[current] = c
+            else:
+                closure.pop(current, None)
+            if d:
+                depth[current] = d
+            else:
+                depth.pop(current, None)
+            if order is None:
+                for child in dag.outputs[current]:
+                    if child in inside:
+                        pending[child] -= 1
+                        if pending[child] == 0:
+                            ready.append(child)
+        return self
+
+    def redundant(self, node: K) -> list[K]:
+        """Returns the inputs of the node that are also ancestors of its
+        other inputs (or repeated), ie. its edges that can be removed
+        without changing the reachability."""
+        inputs = self.dag.inputs[node]
+        reach = 0
+        for _ in inputs:
+            # The strict ancestors of the input, excluding itself
+            reach |= self.closure.get(_, 0) & ~(1 << self.bits[_])
+        res: list[K] = []
+        seen: set[K] = set()
+        for _ in inputs:
+            if _ in seen or (reach >> self.bits[_]) & 1:
+                res.append(_)
+            seen.add(_)
+        return res
+
+    def isa(self, node: K, ancestor: K) -> bool:
+        """Tells if `ancestor` is `node` or one of its ancestors."""
+        if node == ancestor:
+            return True
+        bit = self.bits.get(ancestor)
+        return bit is not None and (self.closure.get(node, 0) >> bit) & 1 == 1
+
+    def common(self, a: K, b: K) -> Optional[K]:
+        """Returns the deepest common ancestor of `a` and `b`, which might
+        be `a` or `b` themselves. Ties are resolved by picking the node
+        that was first used as an input."""
+        if a == b:
+            return a
+        key = (a, b)
+        if key in self.cache:
+            return self.cache[key]
+        mask = self.closure.get(a, 0) & self.closure.get(b, 0)
+        res: Optional[K] = None
+        best = -1
+        while mask:
+            low = mask & -mask
+            node = self.keys[low.bit_length() - 1]
+            if self.depth.get(node, 0) > best:
+                best = self.depth.get(node, 0)
+                res = node
+            mask ^= low
+        self.cache[key] = res
+        return res
+
+
 class DAG(Generic[K, T]):
     """A simple data structure to defined a directed acyclic graph that can
-    be traversed back and forth."""
+    be traversed back and forth. An `indexed` DAG maintains a `DAGIndex`
+    of the ancestor closure for fast subsumption queries."""
 
-    def __init__(self):
+    def __init__(self, indexed: bool = False):
         self.nodes: dict[K, Optional[T]] = {}
         self.outputs: dict[K, list[K]] = {}
         self.inputs: dict[K, list[K]] = {}
+        self.index: Optional[DAGIndex[K]] = DAGIndex(self) if indexed else None
 
     def reset(self):
         self.nodes = {}
         self.outputs = {}
         self.inputs = {}
+        if self.index:
+            self.index.rebuild()
         return self
 
     def asdict(self):
@@ -114,6 +303,8 @@ class DAG(Generic[K, T]):
             self.nodes[node] = value
             self.inputs[node] = []
             self.outputs[node] = []
+            if self.index:
+                self.index.addNode(node)
         if value != None:
             self.nodes[node] = value
         return self
@@ -122,6 +313,8 @@ class DAG(Generic[K, T]):
         for n in self.inputs.get(node, ()):
             self.outputs[n].remove(node)
         self.inputs[node] = []
+        if self.index:
+            self.index.update(node)
         return node
 
     def setInputs(self, node: K, inputs: list[K]):
@@ -138,17 +331,116 @@ class DAG(Generic[K, T]):
         assert (
             inputNode in self.outputs
         ), "Input node should have been registered before"
+        self._checkCycle(node, inputNode)
         self.inputs[node].append(inputNode)
         self.outputs[inputNode].append(node)
-        # TODO: Detect cycle
+        if self.index:
+            self.index.addEdge(node, inputNode)
         return self
 
+    def _checkCycle(self, node: K, inputNode: K):
+        # Raises a `ValueError` if `node` is `inputNode` or one of its
+        # ancestors. This is a bit test on indexed DAGs, and otherwise a
+        # walk of the descendants of `node`, which is skipped when it has
+        # no outputs (as when building a graph from its roots).
+        if node == inputNode or (
+            self.index.isa(inputNode, node)
+            if self.index
+            else self._hasOutputs(node)
+            and any(_ == inputNode for _ in self.descendants(node))
+        ):
+            raise ValueError(f"Adding input {inputNode} to {node} would create a cycle")
+
+    def _hasOutputs(self, node: K) -> bool:
+        return bool(self.outputs[node])
+
     def addInputs(self, node: K, inputNodes: Iterable[K]):
         """Add the given node as inputs to this node"""
         for _ in inputNodes:
             self.addInput(node, _)
         return self
 
+    def addEdges(
+        self,
+        nodes: Union[Iterable[tuple[K, K]], Iterable[K]],
+        inputs: Optional[Iterable[K]] = None,
+    ) -> int:
+        """Adds edges in bulk, given either as `(node, inputNode)` pairs, or
+        as parallel iterables of nodes and input nodes. Missing nodes are
+        created, and edges that already exist (or are repeated) are skipped.
+        The graph is checked for cycles once all the edges are added, in
+        which case they are removed and a `ValueError` is raised. Returns
+        the number of added edges."""
+        added = self._addEdges(nodes if inputs is None else zip(nodes, inputs))
+        if added[0]:
+            try:
+                ranks = self.ranks()
+            except ValueError:
+                self._removeEdges(list(zip(*added)))
+                raise
+            if self.index:
+                # NOTE: Bits are allocated by rank, and the closures of
+                # the nodes are then computed in a single pass.
+                for _ in sorted(set(added[1]), key=ranks.__getitem__):
+                    self.index.allocate(_)
+                self.index.update(*added[0], order=ranks)
+        return len(added[0])
+
+    def _addEdges(self, edges: Iterable[tuple[K, K]]) -> tuple[list[K], list[K]]:
+        # Adds the edges that don't exist yet, with no check, returning
+        # their nodes and input nodes as parallel lists (which, unlike
+        # lists of pairs, don't add work to the garbage collector).
+        nodes, inputs, outputs = self.nodes, self.inputs, self.outputs
+        # NOTE: Inputs are usually few, so we only index them in a set
+        # past a few.
+        known: dict[K, set[K]] = {}
+        addedNodes: list[K] = []
+        addedInputs: list[K] = []
+        for node, inputNode in edges:
+            if node not in nodes:
+                nodes[node] = None
+                inputs[node] = []
+                outputs[node] = []
+            if inputNode not in nodes:
+                nodes[inputNode] = None
+                inputs[inputNode] = []
+                outputs[inputNode] = []
+            existing = inputs[node]
+            if len(existing) < 8:
+                if inputNode in existing:
+                    continue
+            else:
+                index = known.get(node)
+                if index is None:
+                    index = known[node] = set(existing)
+                if inputNode in index:
+                    continue
+                index.add(inputNode)
+            existing.append(inputNode)
+            outputs[inputNode].append(node)
+            addedNodes.append(node)
+            addedInputs.append(inputNode)
+        return addedNodes, addedInputs
+
+    def merge(self, other: "DAG[K, T]"):
+        """Adds the nodes (and their values) and edges of the other DAG to
+        this one, see `addEdges`."""
+        for node, value in other.nodes.items():
+            self.setNode(node, value)
+        self.addEdges((node, _) for node in other.nodes for _ in other.inputs[node])
+        return self
+
+    @classmethod
+    def FromAdjacency(
+        cls, adjacency: Mapping[K, Iterable[K]], indexed: bool = False
+    ) -> "DAG[K, Any]":
+        """Creates a DAG from a mapping of each node to its input nodes."""
+        dag = cls(indexed=indexed)
+        for node in adjacency:
+            dag.setNode(node)
+        dag.addEdges((node, _) for node, inputs in adjacency.items() for _ in inputs)
+        return dag
+
     def addOutput(self, node: K, outputNode: K):
         """Add the given node as outputs of this node"""
         return self.addInput(outputNode, node)
@@ -159,108 +451,478 @@ class DAG(Generic[K, T]):
             self.addOutput(node, _)
         return self
 
-    def ancestors(self, node: K, visited: Optional[list[K]] = None) -> Iterable[K]:
-        """Iterates through the precursors/ancestors of the given node"""
-        parents = self.inputs.get(node, ())
-        v = visited or []
-        # NOTE: If there is a cycle, we're fucked!
-        for _ in parents:
-            yield _
-        v += parents
-        for _ in parents:
-            for n in self.ancestors(_, v):
-                if n not in v:
-                    v.append(n)
-                    yield n
+    def reachability(self) -> DAGIndex[K]:
+        """Returns the index of the DAG, creating it if the DAG was not
+        indexed. It is then maintained as edges are added and removed."""
+        if self.index is None:
+            self.index = DAGIndex(self)
+        return self.index
+
+    def reaches(self, node: K, other: K) -> bool:
+        """Tells if `other` is `node` or one of its descendants. This is a
+        bit test when the DAG is indexed, and a traversal otherwise."""
+        if self.index:
+            return self.index.isa(other, node)
+        elif node == other:
+            return True
+        for _ in self.descendants(node):
+            if _ == other:
+                return True
+        return False
+
+    def transitiveReduction(self) -> int:
+        """Removes the edges that are implied by other paths (and repeated
+        edges), which doesn't change the reachability between nodes.
+        Returns the number of removed edges."""
+        index = self.index or DAGIndex(self)
+        edges: list[tuple[K, K]] = []
+        for node in self.nodes:
+            if len(self.inputs[node]) > 1:
+                edges += ((node, _) for _ in index.redundant(node))
+        if edges:
+            self._removeEdges(edges)
+        return len(edges)
+
+    def _removeEdges(self, edges: list[tuple[K, K]]):
+        # NOTE: The removed edges must not change the reachability (nor
+        # the longest paths), so that the index remains valid.
+        for node, inputNode in edges:
+            self.inputs[node].remove(inputNode)
+            self.outputs[inputNode].remove(node)
+        return self
+
+    def ancestors(self, node: K) -> Iterable[K]:
+        """Iterates through the precursors/ancestors of the given node,
+        breadth-first and without duplicates."""
+        return self._walk(self.inputs, node)
 
     def descendants(self, node: K) -> Iterable[K]:
-        """Iterates through the descendants of the given node"""
-        children = self.outputs.get(node, ())
-        # NOTE: If there is a cycle, we're fucked!
-        for _ in children:
-            yield _
-        for _ in children:
-            yield from self.descendants(_)
+        """Iterates through the descendants of the given node, breadth-first
+        and without duplicates."""
+        return self._walk(self.outputs, node)
+
+    def _walk(self, edges: dict[K, list[K]], node: K) -> Iterable[K]:
+        # NOTE: This is iterative and keeps track of the visited nodes, so
+        # that deep graphs don't hit the recursion limit and cycles terminate.
+        visited: set[K] = {node}
+        pending: list[K] = [node]
+        i = 0
+        while i < len(pending):
+            for _ in edges.get(pending[i], ()):
+                if _ not in visited:
+                    visited.add(_)
+                    pending.append(_)
+                    yield _
+            i += 1
 
     def ranks(self) -> dict[K, int]:
         """Returns the rank for each node in the graph, as a mapping between the
-        node id and the rank. Base rank is 0, result is sorted by ascending rank."""
-        ranks: dict[K, int] = dict((k, 0) for k in self.nodes)
-        while True:
-            has_changed = False
-            for node in self.nodes:
-                rank = (
-                    max(ranks[_] for _ in self.inputs[node]) + 1
-                    if self.inputs[node]
-                    else 0
+        node id and the rank. Base rank is 0, result is sorted by ascending rank.
+        The rank of a node is the length of the longest path from a root,
+        computed in a single topological (Kahn) pass. Raises a `ValueError`
+        if the graph has a cycle."""
+        ranks: dict[K, int] = {}
+        pending: dict[K, int] = {}
+        ready: list[K] = []
+        for node in self.nodes:
+            ranks[node] = 0
+            n = len(self.inputs[node])
+            if n:
+                pending[node] = n
+            else:
+                ready.append(node)
+        i = 0
+        while i < len(ready):
+            node = ready[i]
+            rank = ranks[node] + 1
+            for _ in self.outputs[node]:
+                if ranks[_] < rank:
+                    ranks[_] = rank
+                n = pending[_] - 1
+                pending[_] = n
+                if n == 0:
+                    ready.append(_)
+            i += 1
+        if len(ready) != len(self.nodes):
+            cycle = [k for k, v in pending.items() if v]
+            raise ValueError(f"DAG has a cycle involving nodes: {cycle}")
+        # We bucket the nodes by rank, which preserves the registration
+        # order within a rank without having to sort.
+        levels: list[list[K]] = [[] for _ in range(max(ranks.values(), default=-1) + 1)]
+        for node, rank in ranks.items():
+            levels[rank].append(node)
+        return {node: rank for rank, level in enumerate(levels) for node in level}
+
+    def successors(self, ranks: Optional[dict[K, int]] = None) -> "DAGSuccessors[K]":
+        """Returns a lazy mapping of each node (by ascending rank) to its
+        descendants sorted by rank. Descendants are only computed when
+        accessed, so iterating does not hold the N * N-1 matrix in memory."""
+        return DAGSuccessors(self, self.ranks() if ranks is None else ranks)
+
+
+class DAGSuccessors(Mapping[K, list[K]]):
+    """A read-only view of the successors of each node of a DAG."""
+
+    def __init__(self, dag: DAG[K, Any], ranks: dict[K, int]):
+        self.dag = dag
+        self.ranks = ranks
+
+    def __getitem__(self, node: K) -> list[K]:
+        if node not in self.ranks:
+            raise KeyError(node)
+        return sorted(self.dag.descendants(node), key=self.ranks.__getitem__)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.ranks)
+
+    def __len__(self) -> int:
+        return len(self.ranks)
+
+
+class ArrayDAGEdges(Mapping[int, list[int]]):
+    """A read-only view of the inputs or outputs of the nodes of an
+    `ArrayDAG`, combining the compacted arrays and the append buffer."""
+
+    def __init__(self, dag: "ArrayDAG[Any]", outputs: bool):
+        self.dag = dag
+        self.isOutputs = outputs
+
+    def __getitem__(self, node: int) -> list[int]:
+        if node not in self.dag.nodes:
+            raise KeyError(node)
+        offsets, edges, buffer = self.dag._edges(self.isOutputs)
+        res = (
+            edges[offsets[node] : offsets[node + 1]].tolist()
+            if node + 1 < len(offsets)
+            else []
+        )
+        if node in buffer:
+            res += buffer[node]
+        return res
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.dag.nodes)
+
+    def __len__(self) -> int:
+        return len(self.dag.nodes)
+
+
+class ArrayDAG(DAG[int, T]):
+    """A DAG for dense, non-negative integer keys (like the ones produced by
+    `IntegerID`), that stores its edges in compressed sparse row arrays
+    (offsets and edges as `array('i')`) instead of per-node lists. New edges
+    go to an append buffer that is compacted in a single pass when it
+    grows past a fraction of the graph, or when a bulk traversal needs it."""
+
+    # Minimum number of buffered edges before the buffer is compacted
+    COMPACT_THRESHOLD: int = 1024
+
+    def __init__(self, indexed: bool = False):
+        self.nodes: dict[int, Optional[T]] = {}
+        # One more than the largest key, ie. the length of the offsets
+        self._size: int = 0
+        self._inOffsets: array = array("i", [0])
+        self._inEdges: array = array("i")
+        self._outOffsets: array = array("i", [0])
+        self._outEdges: array = array("i")
+        self._inBuffer: dict[int, list[int]] = {}
+        self._outBuffer: dict[int, list[int]] = {}
+        self._buffered: int = 0
+        self.inputs = ArrayDAGEdges(self, False)
+        self.outputs = ArrayDAGEdges(self, True)
+        self.index: Optional[DAGIndex[int]] = DAGIndex(self) if indexed else None
+
+    @property
+    def edgeCount(self) -> int:
+        return len(self._inEdges) + self._buffered
+
+    def reset(self):
+        self.__init__(indexed=self.index is not None)
+        return self
+
+    def _edges(self, outputs: bool) -> tuple[array, array, dict[int, list[int]]]:
+        return (
+            (self._outOffsets, self._outEdges, self._outBuffer)
+            if outputs
+            else (self._inOffsets, self._inEdges, self._inBuffer)
+        )
+
+    def compact(self):
+        """Merges the append buffer into the offsets/edges arrays."""
+        if self._buffered or len(self._inOffsets) <= self._size:
+            self._inOffsets, self._inEdges = self._compact(
+                self._inOffsets, self._inEdges, self._inBuffer
+            )
+            self._outOffsets, self._outEdges = self._compact(
+                self._outOffsets, self._outEdges, self._outBuffer
+            )
+            self._inBuffer = {}
+            self._outBuffer = {}
+            self._buffered = 0
+        return self
+
+    def _compact(
+        self,
+        offsets: array,
+        edges: array,
+        buffer: dict[int, list[int]],
+        exclude: Optional[Callable[[int, int], bool]] = None,
+    ) -> tuple[array, array]:
+        n = self._size
+        m = len(offsets) - 1
+        res_offsets = array("i", bytes(4 * (n + 1)))
+        res_edges = array("i")
+        for node in range(n):
+            if node < m:
+                start, end = offsets[node], offsets[node + 1]
+                if exclude is None:
+                    res_edges.extend(edges[start:end])
+                else:
+                    res_edges.extend(
+                        _ for _ in edges[start:end] if not exclude(node, _)
+                    )
+            if node in buffer:
+                res_edges.extend(buffer[node])
+            res_offsets[node + 1] = len(res_edges)
+        return res_offsets, res_edges
+
+    def setNode(self, node: int, value: Optional[T] = None):
+        assert node >= 0, f"ArrayDAG expects non-negative integer keys, got: {node}"
+        if node not in self.nodes:
+            self.nodes[node] = value
+            self._size = max(self._size, node + 1)
+            if self.index:
+                self.index.addNode(node)
+        if value != None:
+            self.nodes[node] = value
+        return self
+
+    def clearInputs(self, node: int):
+        if node in self.nodes:
+            self.compact()
+            self._outOffsets, self._outEdges = self._compact(
+                self._outOffsets,
+                self._outEdges,
+                {},
+                lambda _, output: output == node,
+            )
+            self._inOffsets, self._inEdges = self._compact(
+                self._inOffsets,
+                self._inEdges,
+                {},
+                lambda _, __: _ == node,
+            )
+            if self.index:
+                self.index.update(node)
+        return node
+
+    def _addEdges(
+        self, edges: Iterable[tuple[int, int]]
+    ) -> tuple[list[int], list[int]]:
+        # Edges are buffered and then compacted once
+        self.compact()
+        nodes = self.nodes
+        offsets, targets = self._inOffsets, self._inEdges
+        inBuffer, outBuffer = self._inBuffer, self._outBuffer
+        known: dict[int, set[int]] = {}
+        addedNodes: list[int] = []
+        addedInputs: list[int] = []
+        for node, inputNode in edges:
+            if node not in nodes:
+                self.setNode(node)
+            if inputNode not in nodes:
+                self.setNode(inputNode)
+            index = known.get(node)
+            if index is None:
+                index = known[node] = (
+                    set(targets[offsets[node] : offsets[node + 1]])
+                    if node + 1 < len(offsets)
+                    else set()
                 )
-                has_changed = has_changed or rank != ranks[node]
-                ranks[node] = rank
-            if not has_changed:
-                break
-        return {k: v for k, v in sorted(ranks.items(), key=lambda _: _[1])}
-
-    def successors(self, ranks: Optional[dict[K, int]] = None) -> dict[K, list[K]]:
-        # NOTE: This may return a N * N-1 matrix, with N the number of nodes,
-        # so this might take up a bit of memory on large graphs.
-        node_ranks = self.ranks() if ranks is None else ranks
-        return {
-            node: sorted(self.descendants(node), key=lambda _: node_ranks[_])
-            for node in node_ranks
-        }
+            if inputNode not in index:
+                index.add(inputNode)
+                inBuffer.setdefault(node, []).append(inputNode)
+                outBuffer.setdefault(inputNode, []).append(node)
+                addedNodes.append(node)
+                addedInputs.append(inputNode)
+        self._buffered += len(addedNodes)
+        self.compact()
+        return addedNodes, addedInputs
+
+    def _removeEdges(self, edges: list[tuple[int, int]]):
+        # We remove all the edges in a single compaction. Edges may be
+        # repeated, so we count the occurrences to remove.
+        self.compact()
+        for outputs in (False, True):
+            offsets, targets, _ = self._edges(outputs)
+            removed: dict[tuple[int, int], int] = {}
+            for node, inputNode in edges:
+                key = (inputNode, node) if outputs else (node, inputNode)
+                removed[key] = removed.get(key, 0) + 1
+
+            def exclude(node: int, other: int) -> bool:
+                n = removed.get((node, other), 0)
+                if n:
+                    removed[(node, other)] = n - 1
+                return n > 0
+
+            offsets, targets = self._compact(offsets, targets, {}, exclude)
+            if outputs:
+                self._outOffsets, self._outEdges = offsets, targets
+            else:
+                self._inOffsets, self._inEdges = offsets, targets
+        return self
+
+    def addInput(self, node: int, inputNode: int):
+        """Add the given node as input to this node"""
+        self.setNode(node)
+        if inputNode not in self.nodes:
+            self.setNode(inputNode)
+        self._checkCycle(node, inputNode)
+        self._inBuffer.setdefault(node, []).append(inputNode)
+        self._outBuffer.setdefault(inputNode, []).append(node)
+        self._buffered += 1
+        if self._buffered > max(self.COMPACT_THRESHOLD, len(self._inEdges) // 4):
+            self.compact()
+        if self.index:
+            self.index.addEdge(node, inputNode)
+        return self
 
+    def _hasOutputs(self, node: int) -> bool:
+        # NOTE: This doesn't compact, unlike `outputs`
+        offsets = self._outOffsets
+        return bool(self._outBuffer.get(node)) or (
+            node + 1 < len(offsets) and offsets[node + 1] > offsets[node]
+        )
 
-def toASCIILines(dag: DAG) -> Iterable[str]:
-    pass
+    def _walk(self, edges: Mapping[int, list[int]], node: int) -> Iterable[int]:
+        self.compact()
+        offsets, targets, _ = self._edges(edges is self.outputs)
+        if node not in self.nodes:
+            return
+        visited = bytearray(len(offsets))
+        visited[node] = 1
+        pending: list[int] = [node]
+        i = 0
+        while i < len(pending):
+            current = pending[i]
+            for _ in targets[offsets[current] : offsets[current + 1]]:
+                if not visited[_]:
+                    visited[_] = 1
+                    pending.append(_)
+                    yield _
+            i += 1
+
+    def ranks(self) -> dict[int, int]:
+        self.compact()
+        in_offsets, out_offsets, out_edges = (
+            self._inOffsets,
+            self._outOffsets,
+            self._outEdges,
+        )
+        # NOTE: The in-degree of every node is the difference of consecutive
+        # offsets, so there is no per-node list to look at.
+        pending = array("i", (b - a for a, b in zip(in_offsets, in_offsets[1:])))
+        ranks = array("i", bytes(4 * len(pending)))
+        ready: list[int] = [_ for _ in self.nodes if not pending[_]]
+        i = 0
+        while i < len(ready):
+            node = ready[i]
+            rank = ranks[node] + 1
+            for _ in out_edges[out_offsets[node] : out_offsets[node + 1]]:
+                if ranks[_] < rank:
+                    ranks[_] = rank
+                pending[_] -= 1
+                if pending[_] == 0:
+                    ready.append(_)
+            i += 1
+        if len(ready) != len(self.nodes):
+            cycle = [_ for _ in self.nodes if pending[_]]
+            raise ValueError(f"DAG has a cycle involving nodes: {cycle}")
+        levels: list[list[int]] = [[] for _ in range(max(ranks, default=-1) + 1)]
+        for node in self.nodes:
+            levels[ranks[node]].append(node)
+        return {node: rank for rank, level in enumerate(levels) for node in level}
 
 
-def toASCII(dag: DAG) -> str:
-    # return "\n".join(toASCIILines(dag))
+def toASCIILines(dag: DAG, width: int = 160) -> Iterator[str]:
+    """Renders the DAG rank by rank, each node being followed by its direct
+    outputs, with nodes indented by rank. When the graph is too deep for
+    the ranks to fit in `width` characters, the indentation is scaled down,
+    so that lines stay bounded and rendering is linear in the number of
+    nodes and edges."""
     ranks = dag.ranks()
-    successors = dag.successors(ranks)
-    width = max(len(_) for _ in successors.values())
-    depth = max(_ for _ in ranks.values())
-    length = max(len(_) for _ in ranks) + 3
-    step = " " * length
-    tmpl = "{0:" + str(length) + "s}"
-    names = {k: tmpl.format(k) for k in ranks}
-    res = []
-
-    def arrow(n: int):
-        res = ["─"] * n
-        res[-1] = " "
-        res[-2] = "▶"
-        return "".join(res)
-
-    def root(n: int, name: str):
-        res = [" " * length * n]
-        res.append(name)
-        res.append("─" * (length - len(name) - 3))
-        res.append("─┐")
-        return "".join(res)
-
-    def stem(n: int, isLast: bool):
-        res = [" "] * n
-        res[-1] = "─"
-        res[-2] = "└" if isLast else "├"
-        return "".join(res)
-
-    previous_rank = 0
-    for node, succ in successors.items():
-        rank = ranks[node]
+    if not ranks:
+        return
+    depth = max(ranks.values())
+    names: dict[Any, str] = {k: str(k) for k in ranks}
+    length = max(len(_) for _ in names.values()) + 3
+    # NOTE: Ranks are mapped to columns of `length` characters, scaled
+    # down when there are more ranks than columns.
+    columns = max(1, width // length - 1)
+    scale = 1.0 if depth <= columns else columns / depth
+
+    def column(rank: int) -> int:
+        return int(rank * scale) * length
+
+    previous = 0
+    for node, rank in ranks.items():
         if rank == depth:
             break
-        if rank != previous_rank:
-            res.append("")
-            previous_rank = rank
-        res.append(root(rank, node))
-        prefix = " " * (length * (ranks[node] + 1))
-        # TODO: We should probably only do the outputs
-        for i, other in enumerate(succ):
-            src = stem(len(prefix), i == len(succ) - 1)
-            dst = f"{arrow(length * ranks[other])}{names[other]}"[len(src) :]
-            res.append(f"{src}{dst}")
-    return "\n".join(res)
+        if rank != previous:
+            yield ""
+            previous = rank
+        name = names[node]
+        start = column(rank)
+        yield f"{' ' * start}{name}{'─' * (length - len(name) - 3)}─┐"
+        outputs = sorted(dag.outputs[node], key=ranks.__getitem__)
+        for i, other in enumerate(outputs):
+            src = (
+                f"{' ' * (start + length - 2)}{'└' if i == len(outputs) - 1 else '├'}─"
+            )
+            # The arrow spans to the output's column, which is at least
+            # the column after this node's.
+            end = max(column(ranks[other]), start + length)
+            arrow = f"{'─' * (end - len(src) - 2)}▶ " if end - len(src) >= 2 else ""
+            yield f"{src}{arrow}{names[other]:{length}s}"
+
+
+def toASCII(dag: DAG, width: int = 160) -> str:
+    return "\n".join(toASCIILines(dag, width))
+
+
+def toDOTLines(dag: DAG, name: str = "G") -> Iterator[str]:
+    """Renders the DAG in the Graphviz DOT format, one line per node and per
+    edge, labelling nodes with their values when they have one."""
+
+    def quote(value: Any) -> str:
+        return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    yield f"digraph {quote(name)} {{"
+    for node in dag.nodes:
+        value = dag.getNode(node)
+        yield (
+            f"  {quote(node)};"
+            if value is None
+            else f"  {quote(node)} [label={quote(value)}];"
+        )
+    for node in dag.nodes:
+        for _ in dag.outputs[node]:
+            yield f"  {quote(node)} -> {quote(_)};"
+    yield "}"
+
+
+def toDOT(
+    dag: DAG, output: Optional[TextIO] = None, name: str = "G"
+) -> Union[str, TextIO]:
+    """Writes the DOT rendering of the DAG to the given text stream line by
+    line, or returns it as a string when no stream is given."""
+    if output is None:
+        return "\n".join(toDOTLines(dag, name))
+    for line in toDOTLines(dag, name):
+        output.write(line)
+        output.write("\n")
+    return output
 
 
 def graph(dag: Optional[DAG] = None) -> DAGGraphAdapter:
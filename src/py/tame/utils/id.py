@@ -1,6 +1,6 @@
+from threading import Lock
 from typing import Iterator
 
-
 # TODO: Identifiers that are long, monotonic and node-safe
 
 
@@ -11,6 +11,32 @@ def integers() -> Iterator[int]:
         counter += 1
 
 
-IntegerID = integers()
+class Counter:
+    """A monotonic integer generator that can be shared across threads,
+    unlike a generator, which raises when used concurrently."""
+
+    __slots__ = ("value", "lock")
+
+    def __init__(self, start: int = 0):
+        self.value: int = start
+        self.lock = Lock()
+
+    def advance(self, value: int) -> int:
+        """Ensures that the next generated integer is at least `value`."""
+        with self.lock:
+            self.value = max(self.value, value)
+            return self.value
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> int:
+        with self.lock:
+            value = self.value
+            self.value += 1
+            return value
+
+
+IntegerID = Counter()
 
 # EOF